@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pygame
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "atlas_cache")
+
+# Every answer pre-rendered once, on an opaque background, into one packed
+# surface, so showing an answer is a single sub-surface blit. Words are packed
+# left to right on shelves as tall as the tallest word on them.
+#
+# Atlases are saved to CACHE_DIR as a PNG plus a JSON index, named by a hash
+# of the font file, size, color and word list, so a warm restart loads the
+# atlas instead of rasterizing anything and a changed word list or font gets
+# a fresh one.
+#
+# The surface grows with the word list, so lists of more than MAX_WORDS
+# (about 4 MB of pixels at the display's size) aren't put in an atlas.
+class AnswerAtlas:
+    WIDTH = 1024
+    MAX_WORDS = 2048
+
+    def __init__(self, font, size, color, words, background="black", cache_dir=CACHE_DIR):
+        self.font = font
+        self.size = size
+        self.color = color
+        self.background = background
+        self.words = sorted(set(words))
+        if len(self.words) > AnswerAtlas.MAX_WORDS:
+            raise ValueError(f"{len(self.words)} words; an atlas holds {AnswerAtlas.MAX_WORDS}")
+        self.cache_dir = cache_dir
+        self.surface = None
+        self.rects = {}
+        self.key = self._key()
+
+    def _key(self):
+        digest = hashlib.sha1()
+        with open(self.font.path, "rb") as f:
+            digest.update(f.read())
+        digest.update(f"{self.size}:{self.color}:{self.background}".encode())
+        digest.update("\n".join(self.words).encode())
+        return digest.hexdigest()[:16]
+
+    def _paths(self):
+        base = os.path.join(self.cache_dir, self.key)
+        return base + ".png", base + ".json"
+
+    # The rendered word, or None if it isn't in the atlas (yet).
+    def get(self, word):
+        rect = self.rects.get(word)
+        if rect is None:
+            return None
+        return self.surface.subsurface(rect)
+
+    def load(self):
+        image_path, index_path = self._paths()
+        try:
+            with open(index_path, "r") as f:
+                rects = json.load(f)
+            surface = pygame.image.load(image_path)
+        except (OSError, ValueError, pygame.error):
+            return False
+        if pygame.display.get_surface():
+            surface = surface.convert()
+        self.rects = {word: pygame.Rect(rect) for word, rect in rects.items()}
+        self.surface = surface
+        logger.info(f"AnswerAtlas: loaded {len(self.rects)} words from {image_path}")
+        return True
+
+    def save(self):
+        image_path, index_path = self._paths()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        pygame.image.save(self.surface, image_path)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({word: list(rect) for word, rect in self.rects.items()}, f)
+        os.replace(tmp_path, index_path)
+        logger.info(f"AnswerAtlas: saved {len(self.rects)} words to {image_path}")
+
+    def _render_all(self):
+        for word in self.words:
+            text, _ = self.font.render(word, fgcolor=self.color, bgcolor=self.background,
+                size=self.size)
+            yield word, text
+
+    def _pack(self, rendered):
+        rects = {}
+        x = y = shelf_height = 0
+        for word, text in rendered:
+            width, height = text.get_size()
+            if x + width > AnswerAtlas.WIDTH:
+                x, y, shelf_height = 0, y + shelf_height, 0
+            rects[word] = pygame.Rect(x, y, width, height)
+            x += width
+            shelf_height = max(shelf_height, height)
+        return rects, y + shelf_height
+
+    # Renders every word, yielding to the event loop every "batch" words so
+    # the display keeps running. Words already rendered are only shown once
+    # the whole atlas is ready.
+    async def build(self, batch=32):
+        rendered = []
+        for i, item in enumerate(self._render_all()):
+            rendered.append(item)
+            if i % batch == batch - 1:
+                await asyncio.sleep(0)
+        rects, height = self._pack(rendered)
+        surface = pygame.Surface((AnswerAtlas.WIDTH, max(height, 1)))
+        for word, text in rendered:
+            surface.blit(text, rects[word])
+        self.surface, self.rects = surface, rects
+        logger.info(f"AnswerAtlas: built {len(rects)} words, {AnswerAtlas.WIDTH}x{height}")
+
+    async def load_or_build(self):
+        if self.load():
+            return
+        await self.build()
+        try:
+            self.save()
+        except (OSError, pygame.error) as e:
+            logger.warning(f"AnswerAtlas: couldn't save: {e}")
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 
 from gevent import monkey; monkey.patch_all()  # Enable asynchronous behavior
-from gevent import event
+import argparse
 from bottle import Bottle, request, response, route, run, static_file, template
 import bottle
 from collections import Counter
 from datetime import datetime
 from functools import wraps
 import gevent
+from gevent.queue import Empty
 import json
 import logging
 import os
@@ -17,76 +18,231 @@ import string
 import sys
 import time
 
+from broadcaster import Broadcaster
+from decks import DeckIndex, DrawHistory
+from game_state import GameState
+from journal import Journal
+from log_pipeline import setup_logging
+from metrics import CONTENT_TYPE, Metrics
+from tracing import Tracer, new_trace, stamp
+
 my_open = open
 
 logger = logging.getLogger("app:"+__name__)
 
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
-
-shutdown_updated = event.Event()
-start_updated = event.Event()
-next_answer_updated = event.Event()
-
-# Sends the result of fn_content when update_event is set, or every "timeout" seconds.
-# def stream_content(update_event, fn_content, timeout=None):
-def stream_content(update_event, *content, timeout=None):
+hub = Broadcaster()
+
+# Where answers come from: a deck name (see decks.py) or None for every deck,
+# and how many previous games' answers not to repeat.
+DECK = "all"
+EXCLUDE_RECENT_GAMES = 3
+state = None
+# Every change to the game, so a restart resumes it (see journal.py).
+DIR = os.path.dirname(os.path.abspath(__file__))
+JOURNAL_PATH = os.path.join(DIR, "game_journal.jsonl")
+
+HEARTBEAT_SECONDS = 15
+KEEPALIVE = b": keepalive\n\n"
+# How long clients should wait before reconnecting after a dropped stream.
+RETRY_MILLISECONDS = 500
+
+def last_event_id():
+    try:
+        last_id = int(request.get_header("Last-Event-ID", ""))
+    except ValueError:
+        return None
+    # From before a restart whose clock went backwards; nothing to replay.
+    return last_id if last_id <= hub.last_id else None
+
+# Encoded once per state version and shared by every subscriber that
+# connects before the state changes again.
+snapshot_cache = {}
+
+def snapshot_frame(named):
+    key = (state.version, hub.last_id, named)
+    if key not in snapshot_cache:
+        snapshot_cache.clear()
+        snapshot_cache[key] = hub.encode(hub.last_id, (state.snapshot(),),
+            "push_state" if named else None)
+    return snapshot_cache[key]
+
+# Sends each frame published on channels to this subscriber; with named=True
+# each frame says which channel it came from. A client that reconnects with
+# Last-Event-ID first gets the frames it missed. A subscriber to push_state
+# that has nothing to replay from starts with a snapshot of the game state
+# instead. Every "timeout" seconds without an event a comment is sent to keep
+# the connection alive; the state itself is never re-sent.
+def stream_frames(channels, named, timeout):
+    queue = hub.subscribe(channels)
+    try:
+        # Flushes the headers so the client knows it is connected.
+        yield f"retry: {RETRY_MILLISECONDS}\n\n".encode()
+        last_id = last_event_id()
+        if last_id is not None and not hub.covers(channels, last_id):
+            logger.warning("stream_frames: history for %s no longer covers %s", channels, last_id)
+            last_id = None
+        if last_id is None and "push_state" in channels:
+            last_id = hub.last_id
+            yield snapshot_frame(named)
+        if last_id is not None:
+            for last_id, frame, named_frame in hub.since(channels, last_id):
+                yield named_frame if named else frame
+        while True:
+            try:
+                event_id, frame, named_frame = queue.get(timeout=timeout)
+            except Empty:
+                yield KEEPALIVE
+                continue
+            # Already sent during replay.
+            if last_id is not None and event_id <= last_id:
+                continue
+            yield named_frame if named else frame
+    finally:
+        hub.unsubscribe(channels, queue)
+
+# stream_frames as the body of an SSE response, counting the bytes sent.
+def stream_content(channels, named=False, timeout=HEARTBEAT_SECONDS):
     response.content_type = 'text/event-stream'
     response.cache_control = 'no-cache'
-
-    while True:
-        flag_set = update_event.wait(timeout=timeout)
-        if flag_set:
-            update_event.clear()
-        else:
-            logger.info("TIMED OUT! retransmitting...")
-        print(f"content: {str(content)}")
-        content_json = json.dumps(content)
-        logger.info(f"stream_content: {content_json}")
-        yield f"data: {content_json}\n\n"
+    frames = stream_frames(channels, named, timeout)
+    try:
+        for chunk in frames:
+            hub.bytes_sent += len(chunk)
+            yield chunk
+    finally:
+        frames.close()
+
+CHANNELS = ("push_start", "push_next_answer", "push_state", "push_shutdown")
+
+# Time from each request to its delta being published; the display follows
+# the same traces the rest of the way (see tracing.py).
+tracer = Tracer()
+
+def publish_state(delta, trace=None):
+    if trace:
+        stamp(trace, "published")
+        tracer.finish(trace)
+        delta = dict(delta, trace=trace)
+    hub.publish("push_state", delta)
+
+# All channels (or the comma-separated ?channels= subset) on one connection,
+# as named events in publish order.
+@route("/push")
+def push():
+    channels = [c for c in request.query.get("channels", "").split(",") if c] or CHANNELS
+    yield from stream_content(channels, named=True)
 
 @route("/start")
 def user_requested_start():
-    start_updated.set()
+    trace = new_trace(request.path)
+    delta = state.start(deck=request.query.deck or None,
+        length=int(request.query.length or 0) or None,
+        round_seconds=int(request.query.seconds or 0) or None)
+    hub.publish("push_start")
+    publish_state(delta, trace)
 
 @route("/push_start")
 def push_start():
-    print(f"pushing start...")
-    yield from stream_content(start_updated)
+    logger.debug("pushing start")
+    yield from stream_content(["push_start"])
 
 shutdown_now = [False]
 @route("/push_shutdown")
 def push_shutdown():
-    yield from stream_content(shutdown_updated, shutdown_now)
+    yield from stream_content(["push_shutdown"])
 
 @route('/next_answer')
 def next_answer():
-    print('next answer requested')
-    next_answer_updated.set()
+    trace = new_trace(request.path)
+    logger.debug("next answer requested")
+    publish_state(state.next_answer(), trace)
+    hub.publish("push_next_answer")
+
+@route('/correct')
+def correct():
+    trace = new_trace(request.path)
+    publish_state(state.correct(), trace)
+    hub.publish("push_next_answer")
+
+@route("/push_state")
+def push_state():
+    yield from stream_content(["push_state"])
+
+@route('/state')
+def get_state():
+    return dict(state.snapshot(), remaining=state.remaining())
 
 @route("/push_next_answer")
 def push_next_answer():
-    yield from stream_content(next_answer_updated)
+    yield from stream_content(["push_next_answer"])
 
 @route('/shutdown')
 def shutdown():
     global shutdown_now
     shutdown_now[0] = True
-    print("Shutting down...")
-    shutdown_updated.set()
-
-def init():
-    global all_words
-    with open("./allwords.txt", 'r') as f:
-      lines = f.readlines()
+    logger.info("Shutting down...")
+    state.shutdown()
+    hub.publish("push_shutdown", shutdown_now)
+
+# For displays started alongside app.py. app.py only starts listening once
+# the game is loaded, so any answer at all means it's ready.
+@route('/ready')
+def ready():
+    return {"ready": True, "version": state.version}
+
+@route('/subscribers')
+def subscribers():
+    return hub.stats()
+
+metrics = Metrics().process()
+metrics.gauge("app_subscribers", "Open streams per channel.",
+    lambda: {channel: len(queues) for channel, queues in hub.subscribers.items()}, "channel")
+metrics.counter("app_events_published_total", "Events published per channel.",
+    lambda: hub.published, "channel")
+metrics.counter("app_events_dropped_total", "Events dropped from full subscriber queues.",
+    lambda: hub.dropped)
+metrics.counter("app_bytes_sent_total", "Bytes sent on event streams.", lambda: hub.bytes_sent)
+metrics.gauge("app_game_version", "Changes to the game since it started.",
+    lambda: state.version if state else 0)
+
+@route('/traces')
+def traces():
+    return tracer.stats()
+
+@route('/metrics')
+def get_metrics():
+    response.content_type = CONTENT_TYPE
+    return metrics.render()
+
+# With state_dir, the journal and the draw history are kept there rather than
+# next to app.py, so a scratch server (e.g. benchmarks/loadtest.py's) doesn't
+# touch the real game.
+def init(state_dir=None):
+    global state
+    journal_path, history = JOURNAL_PATH, None
+    if state_dir:
+        journal_path = os.path.join(state_dir, os.path.basename(JOURNAL_PATH))
+        history = DrawHistory(os.path.join(state_dir, "deck_history.json"))
+    # Builds the indexes the display process maps too, if they're out of date.
+    state = GameState(DeckIndex.open_default(history=history), DECK,
+        exclude_games=EXCLUDE_RECENT_GAMES, journal=Journal(journal_path))
+    resumed = state.restore()
+    state.journal.open()
+    return resumed
 
 if __name__ == '__main__':
-    # logger.setLevel(logging.DEBUG)
-
-    init()
-    if len(sys.argv) > 1:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--state-dir",
+        help="keep the journal, draw history and log here instead of next to app.py")
+    parser.add_argument("seed", nargs="?", help="anything: the same answers every run")
+    args = parser.parse_args()
+    setup_logging(os.path.join(args.state_dir or DIR, "app.log"))
+
+    if args.seed is not None:
         random.seed(0)
-    run(host='0.0.0.0', port=8080, server='gevent', debug=True, quiet=True)
+    started = time.perf_counter()
+    if not init(args.state_dir):
+        state.start()
+    logger.info("ready in %.0f ms", (time.perf_counter() - started) * 1000)
+    run(host='0.0.0.0', port=args.port, server='gevent', debug=True, quiet=True)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# ms/frame for turning the 192x256 screen into the matrix image: the old
+# tobytes -> frombytes -> rotate path against frame_output.FrameOutput, for
+# the password (-90) and wordle (+90) rotations.
+#
+#   python benchmarks/bench_frame_output.py [--frames N]
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from PIL import Image
+import pygame
+from pygame.image import tobytes as image_to_string
+
+import frame_output
+from frame_output import FrameOutput
+
+SCREEN_WIDTH = 192
+SCREEN_HEIGHT = 256
+
+def old_path(screen, rotation):
+    pixels = image_to_string(screen, "RGB")
+    img = Image.frombytes("RGB", (screen.get_width(), screen.get_height()), pixels)
+    return img.rotate(rotation, Image.NEAREST, expand=1)
+
+def bench(name, fn, frames):
+    fn()
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>24}: {elapsed / frames * 1000:7.3f} ms/frame")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    screen.fill("red", (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT // 2))
+
+    print(f"numpy: {'yes' if frame_output.numpy else 'no'}")
+    for rotation in (-90, 90):
+        output = FrameOutput(screen.get_size(), rotation)
+        bench(f"old {rotation:+d}", lambda: old_path(screen, rotation), args.frames)
+        bench(f"FrameOutput {rotation:+d}", lambda: output.render(screen), args.frames)
+    pygame.quit()
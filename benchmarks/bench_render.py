@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Per-stage cost of the display's render path on a headless box (SDL's dummy
+# driver, no matrix): text layout, Answer.draw, converting the screen for the
+# matrix, rotating it, scaling it for the window, and whole frames through
+# all of them: Game.update, the matrix's -90 rotation and the window scale. Prints min/median/mean per call like
+# pytest-benchmark. --save keeps the medians, and --compare fails (exit 1)
+# if any stage's median got more than --threshold slower than a saved run.
+#
+#   python benchmarks/bench_render.py [--rounds N] [--save FILE] [--compare FILE]
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.abspath(os.path.dirname(__file__) + '/..')
+sys.path.append(ROOT)
+# Instructions are read relative to the working directory.
+os.chdir(ROOT)
+
+import pygame
+
+from answer_atlas import AnswerAtlas
+from displays import scale_to_window
+from frame_output import FrameOutput
+import pygamegameasync as display
+from pygamegameasync import Answer, Game, SCREEN_HEIGHT, SCREEN_WIDTH, render_text
+
+ANSWERS = ["IMMEDIACY", "TUTU", "RELEASE", "COFFEE", "GERLACH", "RANGER"]
+
+def bench(fn, rounds, inner):
+    fn()
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(inner):
+            fn()
+        times.append((time.perf_counter() - start) / inner)
+    return {"min": min(times), "median": statistics.median(times),
+        "mean": statistics.mean(times)}
+
+def stages(game, screen, window):
+    instructions = game.instructions_display
+    answer = game.answer_display
+    answers = iter(ANSWERS * 1000000)
+
+    def text_cold():
+        display.text_cache.entries.clear()
+        render_text(instructions.font, instructions.surface, instructions.text, "white")
+
+    def text_warm():
+        render_text(instructions.font, instructions.surface, instructions.text, "white")
+
+    def draw_answer(atlas):
+        def draw():
+            answer.atlas = atlas
+            answer.answer = next(answers)
+            answer.draw()
+        return draw
+
+    atlas = AnswerAtlas(answer.font, Answer.LETTER_SIZE, "red", ANSWERS + ["GAME OVER"])
+    asyncio.run(atlas.build())
+
+    convert = FrameOutput(screen.get_size(), 0)
+    rotate_password = FrameOutput(screen.get_size(), -90)
+    rotate_wordle = FrameOutput(screen.get_size(), 90)
+    answer_rect = answer.rect((0, SCREEN_HEIGHT/2 - 20))
+
+    matrix = FrameOutput(screen.get_size(), -90)
+    loop = asyncio.new_event_loop()
+
+    # What the display does per changed frame with a matrix and a window.
+    def frame():
+        game.apply_state({"answer": next(answers)})
+        damaged = loop.run_until_complete(game.update(screen))
+        matrix.render(screen)
+        scale_to_window(screen, window, damaged, display.SCALING_FACTOR)
+
+    return [
+        ("render_text (cold)", text_cold, 20),
+        ("render_text (cached)", text_warm, 200),
+        ("Answer.draw (text cache)", draw_answer(None), 200),
+        ("Answer.draw (atlas)", draw_answer(atlas), 200),
+        ("convert (FrameOutput 0)", lambda: convert.render(screen), 200),
+        ("rotate -90", lambda: rotate_password.render(screen), 200),
+        ("rotate +90", lambda: rotate_wordle.render(screen), 200),
+        ("scale full screen", lambda: scale_to_window(screen, window, [screen.get_rect()],
+            display.SCALING_FACTOR), 50),
+        ("scale answer rect", lambda: scale_to_window(screen, window, [answer_rect],
+            display.SCALING_FACTOR), 200),
+        ("frame end to end", frame, 100),
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--save", help="write medians as JSON to this file")
+    parser.add_argument("--compare", help="JSON from an earlier --save to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="slowdown that fails --compare. Default: 0.2 (20%%)")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.freetype.init()
+    window = pygame.display.set_mode((SCREEN_WIDTH*display.SCALING_FACTOR,
+        SCREEN_HEIGHT*display.SCALING_FACTOR))
+    screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    game = Game(None)
+    asyncio.run(game.start())
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    print(f"{'stage':>26} {'min ms':>9} {'median ms':>10} {'mean ms':>9} {'ops/s':>9}")
+    results = {}
+    regressed = []
+    for name, fn, inner in stages(game, screen, window):
+        r = bench(fn, args.rounds, inner)
+        results[name] = r["median"]
+        line = (f"{name:>26} {r['min']*1000:9.3f} {r['median']*1000:10.3f} "
+            f"{r['mean']*1000:9.3f} {1/r['median']:9.0f}")
+        if name in baseline:
+            change = r["median"] / baseline[name] - 1
+            line += f" {change:+7.1%}"
+            if change > args.threshold:
+                regressed.append(name)
+        print(line)
+    print(f"{'frames/sec end to end':>26} {1/results['frame end to end']:9.0f}")
+    pygame.quit()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressed:
+        print(f"slower than {args.compare} by more than {args.threshold:.0%}: "
+            f"{', '.join(regressed)}")
+        sys.exit(1)
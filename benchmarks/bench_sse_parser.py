@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Events/sec for cube_async's SSE parser on large bursts of frames, against
+# the old readuntil(b"\n\n") + decode + per-line split approach.
+#
+#   python benchmarks/bench_sse_parser.py [--frames N] [--chunk BYTES]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
+from cube_async import SseParser
+
+def make_stream(frames):
+    out = bytearray(b": keepalive\n\n")
+    for i in range(frames):
+        channel = ("push_start", "push_next_answer", "push_shutdown")[i % 3]
+        out += f"event: {channel}\nid: {i}\ndata: {json.dumps([[i % 2 == 0]])}\n\n".encode()
+    return bytes(out)
+
+def chunks(stream, size):
+    return [stream[i:i+size] for i in range(0, len(stream), size)]
+
+def old_parse(pieces):
+    # What get_sse_messages did before: split on blank lines, decode each
+    # frame and re-split it into fields.
+    pending = b""
+    count = 0
+    for piece in pieces:
+        pending += piece
+        *frames, pending = pending.split(b"\n\n")
+        for frame in frames:
+            event_id, event, data = None, None, []
+            for line in frame.decode().splitlines():
+                field, _, value = line.partition(":")
+                if value.startswith(" "):
+                    value = value[1:]
+                if field == "id":
+                    event_id = value
+                elif field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+            if data:
+                message = (event_id, event, "\n".join(data))
+                count += 1
+    return count
+
+def new_parse(pieces):
+    parser = SseParser()
+    count = 0
+    for piece in pieces:
+        count += len(parser.feed(piece))
+    return count
+
+def bench(name, fn, pieces, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = fn(pieces)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert count == frames, (name, count)
+    print(f"{name:>8}: {frames / best:12,.0f} events/sec  ({best*1000:.1f} ms)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--chunk", type=int, default=4096, help="bytes per network read")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pieces = chunks(make_stream(args.frames), args.chunk)
+    print(f"{args.frames} frames in {len(pieces)} chunks of {args.chunk} bytes")
+    bench("old", old_parse, pieces, args.frames, args.repeat)
+    bench("parser", new_parse, pieces, args.frames, args.repeat)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# How many displays and controllers one app.py can serve before events arrive
+# late. Starts a scratch app.py (its own port and --state-dir, so the real
+# game is untouched) unless --url points at one, then for each client count
+# in --clients tops the subscribers up to that many, each with a stream on
+# /push_start, /push_next_answer and /push_shutdown like a display, and fires
+# --storms storms of one /start and --burst /next_answers, back to back.
+#
+# Per step it prints the time to open a stream, the delay from each trigger
+# being sent to its event reaching every subscriber, events that never
+# arrived, and app.py's CPU use and resident memory (from its /metrics). This
+# process's own CPU use is shown too: near 100% means the load generator,
+# not app.py, is the bottleneck. --save keeps the delivery p99s, and
+# --compare fails (exit 1) if any step's got more than --threshold slower or
+# missed more events than a saved run.
+#
+#   python benchmarks/loadtest.py [--clients 10,50,100,200] [--url URL]
+#       [--save FILE] [--compare FILE]
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.abspath(os.path.dirname(__file__) + '/..')
+sys.path.append(ROOT)
+from cube_async import SseParser
+from tracing import percentile
+
+CHANNELS = ("push_start", "push_next_answer", "push_shutdown")
+# The channel each trigger publishes on.
+TRIGGERS = {"start": "push_start", "next_answer": "push_next_answer",
+    "shutdown": "push_shutdown"}
+
+# One stream, keeping when (time.monotonic()) each event id arrived.
+class Stream:
+    def __init__(self, session, url, channel):
+        self.session = session
+        self.url = url + channel
+        self.channel = channel
+        self.connect_ms = None
+        self.arrivals = {}
+        self.task = None
+
+    async def open(self):
+        started = time.monotonic()
+        response = await self.session.get(self.url)
+        self.connect_ms = (time.monotonic() - started) * 1000
+        self.task = asyncio.create_task(self.read(response))
+
+    async def read(self, response):
+        parser = SseParser()
+        async with response:
+            async for chunk in response.content.iter_any():
+                now = time.monotonic()
+                for event in parser.feed(chunk):
+                    self.arrivals[int(event.id)] = now
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+
+# Unlabelled samples from a Prometheus text page.
+async def scrape(session, url):
+    async with session.get(url + "metrics") as response:
+        text = await response.text()
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.split()
+            samples[name] = float(value)
+    return samples
+
+# Sends each trigger in turn, waiting for its response, adding when it was
+# sent to sent[its channel].
+async def storm(session, url, triggers, sent):
+    for trigger in triggers:
+        sent_at = time.monotonic()
+        async with session.get(url + trigger) as response:
+            await response.read()
+        sent.setdefault(TRIGGERS[trigger], []).append(sent_at)
+
+# Waits until every stream has as many events as were sent on its channel, or
+# "timeout" seconds.
+async def drain(streams, sent, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(len(s.arrivals) >= len(sent.get(s.channel, ())) for s in streams):
+            return
+        await asyncio.sleep(0.01)
+
+# Delivery latencies (ms) and missed events over streams. The n-th id seen on
+# a channel by any stream is taken to be the n-th trigger sent on it: triggers
+# are sent one at a time, so app.py publishes in the order they were sent.
+def deliveries(streams, sent, since):
+    latencies = []
+    missed = 0
+    for channel, sent_at in sent.items():
+        channel_streams = [s for s in streams if s.channel == channel]
+        ids = sorted({i for s in channel_streams for i in s.arrivals if i > since[s]})
+        sent_at_id = dict(zip(ids, sent_at))
+        for s in channel_streams:
+            arrivals = [(i, t) for i, t in s.arrivals.items() if i in sent_at_id]
+            latencies.extend((t - sent_at_id[i]) * 1000 for i, t in arrivals)
+            missed += len(sent_at) - len(arrivals)
+    return sorted(latencies), missed
+
+def spawn_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    state_dir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    server = subprocess.Popen([sys.executable, "app.py", "--port", str(port),
+        "--state-dir", state_dir.name], cwd=ROOT, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    return server, state_dir, f"http://127.0.0.1:{port}/"
+
+async def wait_until_ready(session, url, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server and server.poll() is not None:
+            raise RuntimeError(f"app.py exited with {server.returncode}")
+        try:
+            async with session.get(url + "ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+async def run(args, url, server):
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0),
+            timeout=timeout) as session:
+        await wait_until_ready(session, url, server)
+        streams = []
+        results = {}
+        print(f"{'clients':>7} {'connect p50':>11} {'p99 ms':>7} {'delivery p50':>12} "
+            f"{'p95':>6} {'p99':>6} {'max ms':>7} {'missed':>6} {'dropped':>7} "
+            f"{'app cpu':>7} {'rss MB':>6} {'load cpu':>8}")
+        for clients in args.clients:
+            new = [Stream(session, url, channel) for _ in range(clients - len(streams) // 3)
+                for channel in CHANNELS]
+            await asyncio.gather(*(s.open() for s in new))
+            streams.extend(new)
+            connects = sorted(s.connect_ms for s in new)
+            # Lets the new streams' first bytes through before the clock starts.
+            await asyncio.sleep(0.2)
+
+            # Events from earlier steps don't count.
+            since = {s: max(s.arrivals, default=0) for s in streams}
+            for s in streams:
+                s.arrivals.clear()
+            before = await scrape(session, url)
+            started, load_cpu = time.monotonic(), time.process_time()
+            sent = {}
+            for _ in range(args.storms):
+                await storm(session, url, ["start"] + ["next_answer"] * args.burst, sent)
+                await asyncio.sleep(args.pause)
+            await drain(streams, sent, args.drain)
+            elapsed = time.monotonic() - started
+            load_cpu = (time.process_time() - load_cpu) / elapsed
+            after = await scrape(session, url)
+
+            latencies, missed = deliveries(streams, sent, since)
+            app_cpu = (after["process_cpu_seconds_total"]
+                - before["process_cpu_seconds_total"]) / elapsed
+            dropped = after["app_events_dropped_total"] - before["app_events_dropped_total"]
+            rss = after["process_resident_memory_bytes"] / 1e6
+            result = {"connect_p50_ms": percentile(connects, 0.5) if connects else 0,
+                "connect_p99_ms": percentile(connects, 0.99) if connects else 0,
+                # Nothing at all arrives when app.py is overwhelmed; "missed"
+                # says so.
+                "delivery_p50_ms": percentile(latencies, 0.5) if latencies else 0,
+                "delivery_p95_ms": percentile(latencies, 0.95) if latencies else 0,
+                "delivery_p99_ms": percentile(latencies, 0.99) if latencies else 0,
+                "delivery_max_ms": latencies[-1] if latencies else 0,
+                "missed": missed, "dropped": int(dropped),
+                "app_cpu": app_cpu, "rss_mb": rss, "load_cpu": load_cpu}
+            results[str(clients)] = result
+            print(f"{clients:7} {result['connect_p50_ms']:11.2f} {result['connect_p99_ms']:7.2f} "
+                f"{result['delivery_p50_ms']:12.2f} {result['delivery_p95_ms']:6.2f} "
+                f"{result['delivery_p99_ms']:6.2f} {result['delivery_max_ms']:7.2f} "
+                f"{missed:6} {int(dropped):7} {app_cpu:7.0%} {rss:6.1f} {load_cpu:8.0%}")
+
+        # Ending the game is only safe on a server of our own.
+        if server:
+            since = {s: max(s.arrivals, default=0) for s in streams}
+            sent = {}
+            await storm(session, url, ["shutdown"], sent)
+            await drain(streams, sent, args.drain)
+            latencies, missed = deliveries(streams, sent, since)
+            print(f"shutdown reached {len(latencies)} of {len(latencies) + missed} "
+                f"subscribers, the last after {latencies[-1] if latencies else 0:.2f} ms")
+        for s in streams:
+            s.close()
+        await asyncio.gather(*(s.task for s in streams if s.task), return_exceptions=True)
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="10,50,100,200",
+        type=lambda value: [int(n) for n in value.split(",")],
+        help="subscriber counts to step through, each with one stream per channel")
+    parser.add_argument("--storms", type=int, default=5, help="storms per step")
+    parser.add_argument("--burst", type=int, default=20, help="/next_answers per storm")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds between storms")
+    parser.add_argument("--drain", type=float, default=5,
+        help="seconds to wait for the last events before counting them missed")
+    parser.add_argument("--url",
+        help="an app.py already running, e.g. http://localhost:8080/. Its game is "
+            "restarted and advanced. Default: start a scratch one")
+    parser.add_argument("--save", help="write each step's results as JSON to this file")
+    parser.add_argument("--compare", help="JSON from an earlier --save to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="delivery p99 slowdown that fails --compare. Default: 0.2 (20%%)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    server = state_dir = None
+    if args.url:
+        url = args.url if args.url.endswith("/") else args.url + "/"
+    else:
+        server, state_dir, url = spawn_server()
+    try:
+        results = asyncio.run(run(args, url, server))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+            state_dir.cleanup()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    regressed = []
+    for clients, result in results.items():
+        if clients not in baseline:
+            continue
+        was = baseline[clients]["delivery_p99_ms"]
+        change = result["delivery_p99_ms"] / was - 1 if was else 0
+        print(f"{clients:>7} clients: delivery p99 {change:+7.1%}, missed "
+            f"{result['missed']} (was {baseline[clients]['missed']})")
+        if change > args.threshold or result["missed"] > baseline[clients]["missed"]:
+            regressed.append(clients)
+    if regressed:
+        print(f"worse than {args.compare} at {', '.join(regressed)} clients")
+        sys.exit(1)
@@ -0,0 +1,112 @@
+from collections import Counter, deque
+from gevent.queue import Queue, Empty, Full
+import json
+import logging
+import time
+
+logger = logging.getLogger("app:"+__name__)
+
+# Fans out published items to every subscriber of a channel. Each subscriber
+# gets its own bounded queue, so one slow client can't hold up the others and
+# no client can "consume" an event on behalf of the rest.
+#
+# Content is encoded into an SSE frame once per published event; every
+# subscriber writes the same bytes. Each event gets an id from a single
+# monotonically increasing counter, and the last few frames of each channel
+# are kept so a reconnecting client can replay what it missed.
+#
+# A queue may subscribe to several channels at once; it then receives their
+# events interleaved in publish order. Items are (id, frame, named_frame),
+# where named_frame carries an "event:" line naming the channel for
+# multiplexed streams.
+class Broadcaster:
+    def __init__(self, maxsize=16, history=32):
+        self.maxsize = maxsize
+        self.history = history
+        self.subscribers = {}
+        self.frames = {}
+        # Ids start from the wall clock so they keep increasing across server
+        # restarts, and a reconnecting client's Last-Event-ID stays meaningful.
+        self.last_id = int(time.time() * 1000)
+        # Ids below this were issued by an earlier process, whose history is
+        # gone.
+        self.first_id = self.last_id
+        self.dropped = 0
+        self.published = Counter()
+        # Counted by whatever writes the frames to clients.
+        self.bytes_sent = 0
+
+    @staticmethod
+    def encode(event_id, content, channel=None):
+        event = f"event: {channel}\n" if channel else ""
+        return f"{event}id: {event_id}\ndata: {json.dumps(content)}\n\n".encode()
+
+    # The latest item published on channel, or None.
+    def frame(self, channel):
+        ring = self.frames.get(channel)
+        return ring[-1] if ring else None
+
+    # Items on channels with an id greater than last_id, oldest first.
+    def since(self, channels, last_id):
+        items = []
+        for channel in channels:
+            items.extend(item for item in self.frames.get(channel, ()) if item[0] > last_id)
+        return sorted(items)
+
+    # Whether since(channels, last_id) is everything published after last_id,
+    # i.e. none of it has been pushed out of the history yet and last_id is
+    # from this process rather than one that ran before a restart.
+    def covers(self, channels, last_id):
+        if last_id < self.first_id:
+            return False
+        for channel in channels:
+            ring = self.frames.get(channel, ())
+            if len(ring) == self.history and ring[0][0] > last_id + 1:
+                return False
+        return True
+
+    def subscribe(self, channels):
+        queue = Queue(maxsize=self.maxsize)
+        for channel in channels:
+            self.subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channels, queue):
+        for channel in channels:
+            queue_set = self.subscribers.get(channel)
+            if queue_set is not None:
+                queue_set.discard(queue)
+
+    def publish(self, channel, *content):
+        self.last_id += 1
+        self.published[channel] += 1
+        item = (self.last_id, self.encode(self.last_id, content),
+            self.encode(self.last_id, content, channel))
+        self.frames.setdefault(channel, deque(maxlen=self.history)).append(item)
+        logger.debug("publish: %s id %s %s", channel, self.last_id, content)
+
+        queues = self.subscribers.get(channel, ())
+        for queue in list(queues):
+            try:
+                queue.put_nowait(item)
+            except Full:
+                # Drop the oldest item rather than block the publisher.
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    pass
+                queue.put_nowait(item)
+                self.dropped += 1
+                logger.warning(f"publish: {channel} subscriber full, dropped oldest")
+        return len(queues)
+
+    def subscriber_count(self, channel):
+        return len(self.subscribers.get(channel, ()))
+
+    def backlog(self, channel):
+        return [queue.qsize() for queue in self.subscribers.get(channel, ())]
+
+    def stats(self):
+        return {channel: {"subscribers": len(queues),
+                          "backlog": [queue.qsize() for queue in queues]}
+                for channel, queues in self.subscribers.items()}
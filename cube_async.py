@@ -1,27 +1,188 @@
 #!/usr/bin/env python3
 
 import asyncio
+from collections import deque
 import json
 import logging
+import random
+import time
 
-async def get_sse_messages(session, url):
-    logging.info(f"process sse: {url}")
-    async with session.get(url) as response:
-        while True:
-            if response.status != 200:
-                c = (await response.content.read()).decode()
-                raise Exception(c)
-            chunk = await response.content.readuntil(b"\n\n")
-            # print(f"chunk: {chunk}")
-            some_data = chunk.strip().decode().lstrip("data: ")
-            print(f"get_sse_messages data: {some_data}")
-            yield some_data
+from tracing import stamp_args
+
+logger = logging.getLogger(__name__)
+
+class SseEvent:
+    __slots__ = ("id", "event", "data", "retry")
+
+    def __init__(self, id, event, data, retry):
+        self.id = id
+        self.event = event
+        self.data = data
+        self.retry = retry
+
+    def __repr__(self):
+        return f"SseEvent(id={self.id!r}, event={self.event!r}, data={self.data!r})"
+
+# Incremental text/event-stream parser, per the HTML spec's "event stream
+# interpretation". feed() takes whatever bytes arrived and returns the events
+# they completed; a partial line stays in one reusable bytearray until the
+# rest arrives. All complete lines in a read are decoded and split in a single
+# pass rather than frame by frame.
+class SseParser:
+    def __init__(self, last_event_id=None, retry=None):
+        self.buffer = bytearray()
+        self.last_event_id = last_event_id
+        self.retry = retry
+        self._event = None
+        self._data = []
+        # The spec's "ID buffer": an id: line only becomes last_event_id once
+        # its event is dispatched, so a frame cut off mid-way isn't skipped
+        # on reconnect.
+        self._id = last_event_id
+
+    def feed(self, chunk):
+        buf = self.buffer
+        buf += chunk
+        if b"\r" in buf:
+            # A trailing CR might be the first half of a CRLF.
+            end = len(buf) - 1 if buf.endswith(b"\r") else len(buf)
+            buf[:end] = buf[:end].replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        end = buf.rfind(b"\n")
+        if end < 0:
+            return []
+        # Only complete lines are decoded, so a UTF-8 sequence split across
+        # reads is never cut in half.
+        lines = str(memoryview(buf)[:end], "utf-8").split("\n")
+        del buf[:end + 1]
+
+        events = []
+        data = self._data
+        event, pending_id, last_event_id, retry = (self._event, self._id, self.last_event_id,
+            self.retry)
+        for line in lines:
+            if not line:
+                last_event_id = pending_id
+                if data:
+                    events.append(SseEvent(last_event_id, event, "\n".join(data), retry))
+                    data.clear()
+                event = None
+                continue
+            name, _, value = line.partition(":")
+            if not name:  # ":" starts a comment
+                continue
+            if value[:1] == " ":
+                value = value[1:]
+            if name == "data":
+                data.append(value)
+            elif name == "event":
+                event = value
+            elif name == "id":
+                if "\0" not in value:
+                    pending_id = value
+            elif name == "retry":
+                if value.isdigit():
+                    retry = int(value)
+        self._event, self._id, self.last_event_id, self.retry = (event, pending_id,
+            last_event_id, retry)
+        return events
+
+# Yields an SseEvent for each event on the stream. Comments (such as the
+# server's keepalives) and frames without data are skipped.
+async def get_sse_messages(session, url, parser=None, on_connect=None):
+    logger.info("process sse: %s", url)
+    parser = parser or SseParser()
+    headers = {"Last-Event-ID": parser.last_event_id} if parser.last_event_id else {}
+    async with session.get(url, headers=headers) as response:
+        if response.status != 200:
+            c = (await response.content.read()).decode()
+            raise Exception(c)
+        if on_connect:
+            on_connect()
+        async for chunk in response.content.iter_any():
+            for event in parser.feed(chunk):
+                logger.debug("get_sse_messages: %s", event)
+                yield event
 
 async def get_serial_messages(reader):
     while True:
         chunk = await reader.readuntil(b'\n')
-        yield chunk.strip().decode().lstrip("data: ")
+        yield chunk.strip().decode().removeprefix("data: ")
+
+# Keeps an SSE stream open for as long as it runs. When the stream drops it
+# reconnects with jittered exponential backoff, starting from the server's
+# "retry:" hint when it sent one, and sends the id of the last event seen so
+# the server replays anything published meanwhile. All subscribers share the
+# caller's session, and so its connection pool.
+class SseSubscriber:
+    def __init__(self, session, url, base_delay=0.5, max_delay=30):
+        self.session = session
+        self.url = url
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.parser = SseParser()
+        self.connected = False
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.events_received = 0
+        self.dropped_at = None
+        self.recover_times = deque(maxlen=32)
+
+    def _on_connect(self):
+        self.connected = True
+        self.connects += 1
+        self.failures = 0
+        if self.dropped_at is not None:
+            self.reconnects += 1
+            recover_time = time.monotonic() - self.dropped_at
+            self.recover_times.append(recover_time)
+            self.dropped_at = None
+            logger.warning("SseSubscriber: %s recovered in %.3fs", self.url, recover_time)
+
+    def delay(self):
+        base = self.parser.retry / 1000 if self.parser.retry is not None else self.base_delay
+        return min(self.max_delay, base * 2 ** self.failures) * random.uniform(0.5, 1.0)
+
+    async def messages(self):
+        while True:
+            try:
+                async for event in get_sse_messages(self.session, self.url, self.parser,
+                        self._on_connect):
+                    self.events_received += 1
+                    yield event
+            except Exception as e:
+                logger.warning("SseSubscriber: %s dropped: %r", self.url, e)
+            if self.connected:
+                self.connected = False
+                self.dropped_at = time.monotonic()
+            else:
+                self.failures += 1
+            # Drops any half-received frame; the server replays it.
+            self.parser = SseParser(self.parser.last_event_id, self.parser.retry)
+            await asyncio.sleep(self.delay())
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "events_received": self.events_received,
+            "last_recover_time": self.recover_times[-1] if self.recover_times else None,
+            "max_recover_time": max(self.recover_times, default=None),
+        }
+
+async def trigger_events_from_sse(subscriber, events, event):
+    async for message in subscriber.messages():
+        events.trigger(event, *json.loads(message.data))
 
-async def trigger_events_from_sse(session, events, event, url):
-    async for message in get_sse_messages(session, url):
-        events.trigger(event, *json.loads(message))
+# Demultiplexes a stream of named events (see app.py's /push) into
+# events.trigger(prefix + name, ...), in the order they were published.
+async def dispatch_events_from_sse(subscriber, events, prefix):
+    async for message in subscriber.messages():
+        if message.event is None:
+            logger.warning("dispatch_events_from_sse: unnamed event from %s", subscriber.url)
+            continue
+        args = json.loads(message.data)
+        stamp_args(args, "sse_received")
+        events.trigger(prefix + message.event, *args)
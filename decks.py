@@ -0,0 +1,229 @@
+import array
+from bisect import bisect_right
+import glob
+import json
+import logging
+import os
+import random
+
+from wordstore import WordCursor, WordStore
+
+logger = logging.getLogger(__name__)
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_PATH = os.path.join(DIR, "deck_history.json")
+
+# Word ids pack the deck's number into the high bits and the word's position
+# in that deck's WordStore into the low bits.
+DECK_SHIFT = 24
+
+def letter_mask(word):
+    mask = 0
+    for c in word:
+        i = ord(c) - ord("A")
+        if 0 <= i < 26:
+            mask |= 1 << i
+    return mask
+
+# Answers already shown, per game, kept for the last "keep" games and saved
+# so repeats are avoided across restarts. The file is rewritten when a game
+# starts, every "save_every" draws and on flush(), not on every draw, so a
+# crash forgets at most save_every - 1 of the current game's answers.
+class DrawHistory:
+    def __init__(self, path=HISTORY_PATH, keep=20, save_every=10):
+        self.path = path
+        self.keep = keep
+        self.save_every = save_every
+        self.unsaved = 0
+        try:
+            with open(path, "r") as f:
+                self.games = json.load(f)
+        except (OSError, ValueError):
+            self.games = []
+
+    def new_game(self):
+        self.games = self.games[-(self.keep - 1):] + [[]]
+        self.save()
+
+    def record(self, word):
+        if not self.games:
+            self.games.append([])
+        self.games[-1].append(word)
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def flush(self):
+        if self.unsaved:
+            self.save()
+
+    # Words shown in the last "games" games.
+    def recent(self, games):
+        return {word for game in self.games[-games:] for word in game} if games else set()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.games, f)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+
+# Word lists ("decks") indexed by deck, word length and letter set, built once
+# per deck and rebuilt only for decks whose file changed (see refresh).
+# Decks are named after their files: playawords.txt is "playa".
+class DeckIndex:
+    def __init__(self, paths, history=None):
+        self.paths = dict(paths)
+        self.names = sorted(self.paths)
+        self.history = history or DrawHistory()
+        self.stores = {}
+        self.mtimes = {}
+        self.by_length = {}
+        self.masks = {}
+        self.refresh()
+
+    @classmethod
+    def open_default(cls, directory=DIR, history=None):
+        paths = {}
+        for path in glob.glob(os.path.join(directory, "*words.txt")):
+            name = os.path.basename(path)[:-len("words.txt")]
+            paths[name] = path
+        return cls(paths, history)
+
+    def refresh(self):
+        for name in self.names:
+            path = self.paths[name]
+            mtime = os.path.getmtime(path)
+            if self.mtimes.get(name) != mtime:
+                self._index(name, path)
+                self.mtimes[name] = mtime
+
+    def _index(self, name, path):
+        if name in self.stores:
+            self.stores[name].close()
+        store = self.stores[name] = WordStore.open(path)
+        base = self.names.index(name) << DECK_SHIFT
+        by_length = {}
+        masks = array.array("I")
+        for i, word in enumerate(store):
+            by_length.setdefault(len(word), array.array("I")).append(base | i)
+            masks.append(letter_mask(word))
+        self.by_length[name] = by_length
+        self.masks[name] = masks
+        logger.info(f"DeckIndex: indexed {len(store)} words in deck {name}")
+
+    def word(self, word_id):
+        name = self.names[word_id >> DECK_SHIFT]
+        return self.stores[name][word_id & ((1 << DECK_SHIFT) - 1)]
+
+    def words(self, deck=None):
+        for name in ([deck] if deck else self.names):
+            yield from self.stores[name]
+
+    # Ids of the words in deck (all decks if None) with the given length
+    # (any if None), straight from the length index.
+    def candidates(self, deck=None, length=None):
+        arrays = []
+        for name in ([deck] if deck else self.names):
+            by_length = self.by_length[name]
+            for n in ([length] if length else by_length):
+                arrays.append(by_length.get(n, ()))
+        return Candidates(arrays)
+
+    # A Deck drawing from deck/length without repeats, skipping words that
+    # don't use all of the letters in "letters", that use any letter outside
+    # "allowed", or that were shown in the last exclude_games games. Passing
+    # "recent" (the words to skip) recreates a deck that already started
+    # rather than starting a new game in the history.
+    def deck(self, deck=None, length=None, letters=None, allowed=None, exclude_games=0,
+            recent=None):
+        return Deck(self, deck, length, letters, allowed, exclude_games, recent=recent)
+
+    def restore(self, d):
+        restored = self.deck(d["deck"], d["length"], d["letters"], d["allowed"],
+            recent=d["recent"])
+        if d["cursor"]["n"] != len(restored.ids):
+            raise ValueError(f"deck {d['deck']} changed since it was saved")
+        restored.cursor = WordCursor.from_dict(d["cursor"])
+        return restored
+
+# The length index's arrays read as one sequence without copying them, so a
+# deck costs one entry per (deck, length) rather than one per word. Item i is
+# found by bisecting the arrays' start positions.
+class Candidates:
+    def __init__(self, arrays):
+        self.arrays = [ids for ids in arrays if len(ids)]
+        self.starts = []
+        n = 0
+        for ids in self.arrays:
+            self.starts.append(n)
+            n += len(ids)
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        k = bisect_right(self.starts, i) - 1
+        return self.arrays[k][i - self.starts[k]]
+
+# One game's draws from a DeckIndex query. Filters other than deck and length
+# are checked as words are drawn, so starting a game doesn't scan the list.
+class Deck:
+    MAX_RECENT = 0.5
+
+    def __init__(self, index, deck=None, length=None, letters=None, allowed=None,
+            exclude_games=0, rng=random, recent=None):
+        self.index = index
+        self.options = {"deck": deck, "length": length, "letters": letters, "allowed": allowed}
+        self.ids = index.candidates(deck, length)
+        self.cursor = WordCursor(len(self.ids), rng)
+        self.required = letter_mask(letters) if letters else 0
+        self.forbidden = ~letter_mask(allowed) & ((1 << 26) - 1) if allowed else 0
+        # Cursor positions used by the last draw, for replay().
+        self.picks = []
+        if recent is None:
+            # Fewer games are excluded when their words would take more than
+            # MAX_RECENT of the deck, so a game that drew most of it doesn't
+            # leave the next ones with nothing to draw.
+            self.recent = index.history.recent(exclude_games)
+            while exclude_games and len(self.recent) > len(self.ids) * Deck.MAX_RECENT:
+                exclude_games -= 1
+                self.recent = index.history.recent(exclude_games)
+            index.history.new_game()
+        else:
+            self.recent = set(recent)
+
+    def _matches(self, word_id):
+        name = self.index.names[word_id >> DECK_SHIFT]
+        mask = self.index.masks[name][word_id & ((1 << DECK_SHIFT) - 1)]
+        return mask & self.required == self.required and not mask & self.forbidden
+
+    # The next word, or None when the deck is used up.
+    def draw(self):
+        self.picks = []
+        while True:
+            i = self.cursor.draw()
+            if i is None:
+                return None
+            self.picks.append(self.cursor.last_pick)
+            word_id = self.ids[i]
+            if not self._matches(word_id):
+                continue
+            word = self.index.word(word_id)
+            if word in self.recent:
+                continue
+            self.index.history.record(word)
+            return word
+
+    # Repeats a draw made with the given picks on a deck in the state it was
+    # in then. The drawn word was already recorded in the history.
+    def replay(self, picks):
+        for pick in picks:
+            self.cursor.draw(pick)
+        self.picks = list(picks)
+
+    def to_dict(self):
+        return dict(self.options, recent=sorted(self.recent), cursor=self.cursor.to_dict())
@@ -0,0 +1,153 @@
+import logging
+import os
+import struct
+import time
+
+import pygame
+
+logger = logging.getLogger(__name__)
+
+# Where the display's frames go. Every backend takes the same calls from the
+# frame loop: show(screen, damaged, exposed) after each frame, with the
+# rectangles of screen that changed (empty if none), then close(). Several
+# can run at once, e.g. a window mirroring the matrix.
+#
+#   window    a pygame window, scaled up
+#   matrix    the LED matrix, through MatrixOutput
+#   null      nothing; with SDL's dummy video driver it needs no display
+#   recorder  every changed frame appended to a file (see read_recording)
+DISPLAYS = ("window", "matrix", "null", "recorder")
+
+# Copies the given rectangles of screen onto window, scaled up, and returns
+# the window rectangles they cover.
+def scale_to_window(screen, window, rects, scale):
+    window_rects = []
+    for rect in rects:
+        window_rect = pygame.Rect(rect.x*scale, rect.y*scale, rect.width*scale, rect.height*scale)
+        window.blit(pygame.transform.scale(screen.subsurface(rect), window_rect.size),
+            window_rect)
+        window_rects.append(window_rect)
+    return window_rects
+
+# Every backend counts the frames it shows and notes, as a
+# time.perf_counter() value, when it showed the first one.
+class NullDisplay:
+    name = "null"
+
+    def __init__(self):
+        self.frames = 0
+        self.first_shown = None
+
+    def _shown(self):
+        self.frames += 1
+        if self.first_shown is None:
+            self.first_shown = time.perf_counter()
+
+    def show(self, screen, damaged, exposed=False):
+        if damaged:
+            self._shown()
+
+    def first_pixel(self):
+        return self.first_shown
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"frames": self.frames}
+
+class WindowDisplay(NullDisplay):
+    name = "window"
+
+    def __init__(self, size, scale):
+        super().__init__()
+        self.scale = scale
+        self.window = pygame.display.set_mode((size[0]*scale, size[1]*scale))
+
+    def show(self, screen, damaged, exposed=False):
+        if exposed:
+            damaged = [screen.get_rect()]
+        if damaged:
+            pygame.display.update(scale_to_window(screen, self.window, damaged, self.scale))
+            self._shown()
+
+class MatrixDisplay(NullDisplay):
+    name = "matrix"
+
+    def __init__(self, matrix, size, rotation, canvas=None):
+        # Brings in PIL and numpy, which only the matrix needs.
+        from matrix_output import MatrixOutput
+        super().__init__()
+        self.output = MatrixOutput(matrix, size, rotation, canvas)
+        self.output.start()
+
+    def show(self, screen, damaged, exposed=False):
+        if damaged:
+            self.output.publish(screen)
+            self.frames += 1
+
+    # When the panel, not just the buffer, first had a frame.
+    def first_pixel(self):
+        return self.output.first_shown
+
+    def close(self):
+        self.output.stop()
+
+    def stats(self):
+        return {"frames": self.frames, "shown": self.output.frames_shown,
+            "replaced": self.output.frames_replaced}
+
+# A frame is a header (time.time() as a double, width and height as uint16)
+# followed by width*height RGB pixels.
+FRAME_HEADER = struct.Struct("<dHH")
+
+class RecorderDisplay(NullDisplay):
+    name = "recorder"
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.file = open(path, "wb")
+
+    def show(self, screen, damaged, exposed=False):
+        if damaged or not self.frames:
+            width, height = screen.get_size()
+            self.file.write(FRAME_HEADER.pack(time.time(), width, height))
+            self.file.write(pygame.image.tobytes(screen, "RGB"))
+            self._shown()
+
+    def close(self):
+        self.file.close()
+        logger.info(f"RecorderDisplay: wrote {self.frames} frames to {self.path}")
+
+# Yields (time, surface) for each frame in a RecorderDisplay file.
+def read_recording(path):
+    with open(path, "rb") as f:
+        while header := f.read(FRAME_HEADER.size):
+            t, width, height = FRAME_HEADER.unpack(header)
+            pixels = f.read(width * height * 3)
+            yield t, pygame.image.frombytes(pixels, (width, height), "RGB")
+
+# The displays named in the comma-separated "names". matrix() is called for
+# the RGBMatrix only if the matrix is one of them.
+def open_displays(names, size, scale=3, rotation=-90, matrix=None,
+        recording="frames.rec"):
+    displays = []
+    for name in names.split(","):
+        if name == "window":
+            displays.append(WindowDisplay(size, scale))
+        elif name == "matrix":
+            displays.append(MatrixDisplay(matrix(), size, rotation))
+        elif name == "null":
+            displays.append(NullDisplay())
+        elif name == "recorder":
+            displays.append(RecorderDisplay(recording))
+        else:
+            raise ValueError(f"unknown display {name!r}; choose from {', '.join(DISPLAYS)}")
+    return displays
+
+# SDL needs a video driver before pygame.init(); without a window there's
+# nothing for it to open, so it gets the dummy one.
+def use_headless_driver(names):
+    if "window" not in names.split(","):
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
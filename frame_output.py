@@ -0,0 +1,81 @@
+from PIL import Image
+import pygame
+from pygame.image import tobytes as image_to_string
+
+try:
+    import numpy
+    import pygame.surfarray
+except ImportError:
+    numpy = None
+
+# Turns the pygame screen into the rotated RGB image the matrix wants.
+#
+# rotation is in degrees counter-clockwise, as for PIL's Image.rotate, and
+# must be a multiple of 90. With numpy and a 32-bit screen, the rotation is a
+# strided view of the screen's pixels (one uint32 each), copied into a
+# preallocated array and unpacked straight into a preallocated image: no
+# per-frame allocations beyond the view. Otherwise it falls back to
+# tobytes/frombytes/rotate, pasting the result into the same image.
+#
+# buffers > 1 keeps that many independent output images, so one can be
+# filled while another is still being read (see render's slot).
+class FrameOutput:
+    def __init__(self, size, rotation, buffers=1):
+        if rotation % 90:
+            raise ValueError(f"rotation must be a multiple of 90: {rotation}")
+        self.size = size
+        self.rotation = rotation % 360
+        width, height = size
+        self.out_size = (height, width) if self.rotation % 180 else (width, height)
+        self.images = [Image.new("RGB", self.out_size) for _ in range(buffers)]
+        if numpy:
+            self.arrays = [numpy.empty((self.out_size[1], self.out_size[0]), numpy.uint32)
+                for _ in range(buffers)]
+        self._rawmode = {}
+
+    # The PIL raw mode that reads a pixel of surface from its uint32 in
+    # memory, e.g. "BGRX", or None if it can't.
+    def rawmode(self, surface):
+        key = (surface.get_bitsize(), surface.get_shifts())
+        if key not in self._rawmode:
+            mode = None
+            if surface.get_bytesize() == 4:
+                channels = ["X"] * 4
+                for channel, shift in zip("RGB", surface.get_shifts()):
+                    channels[shift // 8] = channel
+                if not numpy.little_endian:
+                    channels.reverse()
+                mode = "".join(channels)
+            self._rawmode[key] = mode
+        return self._rawmode[key]
+
+    # pixels is indexed [x, y]; the result is indexed [row, column] of the
+    # rotated image.
+    def _rotated(self, pixels):
+        if self.rotation == 0:
+            return pixels.T
+        if self.rotation == 90:
+            return pixels[::-1, :]
+        if self.rotation == 180:
+            return pixels.T[::-1, ::-1]
+        return pixels[:, ::-1]
+
+    def render(self, screen, slot=0):
+        rawmode = self.rawmode(screen) if numpy else None
+        if rawmode is None:
+            pixels = image_to_string(screen, "RGB")
+            img = Image.frombytes("RGB", screen.get_size(), pixels)
+            # Into images[slot], which MatrixOutput's thread reads.
+            self.images[slot].paste(img.rotate(self.rotation, Image.NEAREST, expand=1))
+            return self.images[slot]
+
+        out = self.arrays[slot]
+        pixels = pygame.surfarray.pixels2d(screen)
+        try:
+            numpy.copyto(out, self._rotated(pixels))
+        finally:
+            # Unlocks the surface.
+            del pixels
+        img = self.images[slot]
+        img.frombytes(out, "raw", rawmode)
+        return img
@@ -0,0 +1,116 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ROUND_SECONDS = 60
+
+# The one copy of the game: which deck answers come from, the current answer,
+# the score and the round timer. Displays get a snapshot when they connect
+# and then only the fields each change touches (a delta), so every display
+# shows the same thing at a constant cost per event.
+#
+# With a journal (see journal.py) every change is recorded along with the
+# cursor positions its draw used, so restore() can rebuild the game, deck and
+# all, by loading the last snapshot and replaying the changes after it.
+class GameState:
+    def __init__(self, decks, deck=None, length=None, exclude_games=0,
+            round_seconds=ROUND_SECONDS, journal=None):
+        self.decks = decks
+        self.journal = journal
+        self.options = {"deck": deck, "length": length, "exclude_games": exclude_games}
+        self.round_seconds = round_seconds
+        self.answers = None
+        self.answer = None
+        self.score = 0
+        self.round = 0
+        self.started_at = None
+        self.version = 0
+
+    def _changed(self, **delta):
+        for key, value in delta.items():
+            setattr(self, key, value)
+        self.version += 1
+        return delta
+
+    def _draw(self):
+        return self.answers.draw() or "GAME OVER"
+
+    def _record(self, kind, delta, **fields):
+        if self.journal:
+            self.journal.append(dict(fields, type=kind, picks=self.answers.picks, delta=delta))
+            if self.journal.needs_snapshot():
+                self.journal.snapshot(self.to_dict())
+        return delta
+
+    def start(self, deck=None, length=None, round_seconds=None):
+        options = dict(self.options)
+        if deck:
+            options["deck"] = deck
+        if length:
+            options["length"] = length
+        self.decks.refresh()
+        self.answers = self.decks.deck(**options)
+        delta = self._changed(round=self.round + 1, score=0, answer=self._draw(),
+            started_at=time.time(), round_seconds=round_seconds or self.round_seconds)
+        return self._record("start", delta, options=options,
+            recent=sorted(self.answers.recent))
+
+    def next_answer(self):
+        return self._record("next_answer", self._changed(answer=self._draw()))
+
+    def correct(self):
+        return self._record("correct", self._changed(score=self.score + 1, answer=self._draw()))
+
+    def shutdown(self):
+        self.decks.history.flush()
+        if self.journal:
+            self.journal.append({"type": "shutdown"})
+            self.journal.flush_soon()
+
+    def remaining(self):
+        if self.started_at is None:
+            return None
+        return max(0, self.round_seconds - (time.time() - self.started_at))
+
+    # Repeats a journaled change without drawing or touching the history.
+    def apply(self, record):
+        kind = record["type"]
+        if kind == "start":
+            self.answers = self.decks.deck(**record["options"], recent=record["recent"])
+        if kind in ("start", "next_answer", "correct"):
+            self.answers.replay(record["picks"])
+            self._changed(**record["delta"])
+
+    def to_dict(self):
+        return {"options": self.options, "answer": self.answer, "score": self.score,
+            "round": self.round, "started_at": self.started_at,
+            "round_seconds": self.round_seconds, "version": self.version,
+            "answers": self.answers.to_dict() if self.answers else None}
+
+    # Rebuilds the game from the journal. Returns False, leaving the game as
+    # it is, if there's nothing to resume: no journal, or the last game was
+    # shut down rather than interrupted.
+    def restore(self):
+        started = time.perf_counter()
+        state, records = self.journal.load()
+        if records and records[-1]["type"] == "shutdown" or not (state or records):
+            return False
+        try:
+            if state:
+                answers = state.pop("answers")
+                self.__dict__.update(state)
+                self.answers = self.decks.restore(answers) if answers else None
+            for record in records:
+                self.apply(record)
+        except (KeyError, ValueError, IndexError) as e:
+            logger.warning(f"GameState: couldn't restore from {self.journal.path}: {e!r}")
+            return False
+        logger.info(f"GameState: restored round {self.round}, answer {self.answer}, from "
+            f"{len(records)} records in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return True
+
+    def snapshot(self):
+        return {"snapshot": True, "answer": self.answer, "score": self.score,
+            "round": self.round, "started_at": self.started_at,
+            "round_seconds": self.round_seconds, "version": self.version}
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import time
+
+from real_threads import allocate_lock, start_thread
+
+logger = logging.getLogger(__name__)
+
+# An append-only log of JSON records, one per line, plus an occasional
+# snapshot of the whole state, so a process can pick up where it left off
+# after a crash or restart.
+#
+# append() only queues the record; a background thread (a real OS thread,
+# even under gevent) writes whatever has queued up every flush_interval
+# seconds in one write and fsyncs it, so recording an event never waits on
+# the disk. At most flush_interval seconds of records are lost in a crash.
+# Every snapshot_every records the owner is asked (needs_snapshot) to take a
+# snapshot, which the same thread writes before emptying the journal, so
+# that restoring never replays more than snapshot_every records.
+#
+# Records get a sequence number "seq" and a timestamp "t". The snapshot
+# remembers the seq it includes, so records already in it are skipped if the
+# process died between writing the snapshot and truncating the journal.
+class Journal:
+    def __init__(self, path, flush_interval=0.5, snapshot_every=100):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.since_snapshot = 0
+        self.pending = []
+        self.valid_bytes = None
+        self.file = None
+        self.join = None
+        # (seq, state as JSON) for the thread to write.
+        self.pending_snapshot = None
+        self.lock = allocate_lock()
+        self.write_lock = allocate_lock()
+        # Held except to wake the thread early (flush_soon, close).
+        self.wakeup = allocate_lock()
+        self.wakeup.acquire()
+        self.stopping = False
+        self.records_written = 0
+        self.flushes = 0
+        self.snapshots = 0
+
+    # The last snapshot's state (None if there isn't one) and the records
+    # appended after it, in order. A torn last line, from a crash in the
+    # middle of a write, ends the journal and is cut off when it's opened.
+    def load(self):
+        state, seq = None, 0
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            state, seq = snapshot["state"], snapshot["seq"]
+        except (OSError, ValueError, KeyError):
+            pass
+        records = []
+        self.valid_bytes = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("no newline")
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Journal: {self.path}: ignoring torn record at "
+                            f"byte {self.valid_bytes}")
+                        break
+                    self.valid_bytes += len(line)
+                    if record["seq"] > seq:
+                        records.append(record)
+        except OSError:
+            pass
+        self.seq = records[-1]["seq"] if records else seq
+        self.since_snapshot = len(records)
+        return state, records
+
+    # Opens the journal for appending and starts the flush thread.
+    def open(self):
+        if self.valid_bytes is None:
+            self.load()
+        self.file = open(self.path, "ab")
+        if self.file.tell() > self.valid_bytes:
+            self.file.truncate(self.valid_bytes)
+        self.join = start_thread(self._run, "journal")
+        return self
+
+    def close(self):
+        self.stopping = True
+        if self.join:
+            self.flush_soon()
+            self.join()
+            self.join = None
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def append(self, record):
+        with self.lock:
+            self.seq += 1
+            record = dict(record, seq=self.seq, t=time.time())
+            self.pending.append(json.dumps(record).encode() + b"\n")
+            self.since_snapshot += 1
+        return record["seq"]
+
+    def needs_snapshot(self):
+        return self.since_snapshot >= self.snapshot_every
+
+    # Writes the pending snapshot and records now, on the calling thread.
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                snapshot, self.pending_snapshot = self.pending_snapshot, None
+            if snapshot:
+                seq, state = snapshot
+                tmp_path = self.snapshot_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(f'{{"seq": {seq}, "state": {state}}}')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                if self.file:
+                    self.file.truncate(0)
+                self.snapshots += 1
+            if not pending or not self.file:
+                return
+            self.file.write(b"".join(pending))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records_written += len(pending)
+            self.flushes += 1
+
+    # Has the thread flush now rather than at the end of its interval.
+    def flush_soon(self):
+        try:
+            self.wakeup.release()
+        except RuntimeError:
+            pass  # Already woken.
+
+    # Has the thread save state, which must include every record appended so
+    # far, and empty the journal. Records still queued are in state, so they
+    # are dropped rather than written.
+    def snapshot(self, state):
+        state = json.dumps(state)
+        with self.lock:
+            self.pending_snapshot = (self.seq, state)
+            self.pending = []
+            self.since_snapshot = 0
+        self.flush_soon()
+
+    def _run(self):
+        while not self.stopping:
+            # Taken back when flush_soon released it, so it's held again.
+            self.wakeup.acquire(timeout=self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Journal: {self.path}: flush failed: {e}")
+
+    def stats(self):
+        return {"seq": self.seq, "pending": len(self.pending),
+            "records_written": self.records_written, "flushes": self.flushes,
+            "snapshots": self.snapshots}
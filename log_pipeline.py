@@ -0,0 +1,125 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import sys
+
+from real_threads import simple_queue, start_thread
+
+# Logging for app.py and the display that never waits on the disk or the
+# console: records are put on a queue by the code that logs them and written
+# by a background thread (QueueHandler + QueueListener). Formatting happens
+# on that thread too, except for merging the message's arguments.
+#
+# Each call site (file and line) may log "rate" records a second, with
+# bursts of up to "burst"; past that only one record in "sample" gets
+# through, carrying how many were suppressed since the last one. So a log
+# call on every frame or event can't flood the SD card.
+#
+# The file gets one JSON object per line; the console gets plain text.
+# Disabled levels are filtered by logger.isEnabledFor before any of this, so
+# call sites should pass arguments (logger.debug("x %s", x)) rather than
+# f-strings to cost next to nothing when off.
+
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "suppressed"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"t": round(record.created, 6), "level": record.levelname,
+            "logger": record.name, "msg": record.getMessage(),
+            "where": f"{record.module}:{record.lineno}"}
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        # Anything passed in extra={...}.
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=repr)
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate=10, burst=20, sample=100):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        # (file, line) -> [tokens, last refill, suppressed]
+        self.sites = {}
+
+    def filter(self, record):
+        # Warnings and worse always get through.
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        site = self.sites.get(key)
+        if site is None:
+            site = self.sites[key] = [self.burst, now, 0]
+        site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+        site[1] = now
+        if site[0] >= 1:
+            site[0] -= 1
+        else:
+            site[2] += 1
+            if site[2] < self.sample:
+                return False
+            site[2] -= 1
+        record.suppressed, site[2] = site[2], 0
+        return True
+
+# A QueueListener whose thread is a real OS thread even under gevent (see
+# real_threads.py), so writing the log never stops app.py's requests.
+class LogQueueListener(logging.handlers.QueueListener):
+    def start(self):
+        self._thread = start_thread(self._monitor, "log")
+
+    def stop(self):
+        if self._thread:
+            self.enqueue_sentinel()
+            self._thread()
+            self._thread = None
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    # Only what must happen on the calling thread: the message's arguments
+    # and the traceback may not be around later.
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# Sends every logger's records through the queue to "path" (JSON lines; none
+# if None) and the console. LOG_LEVEL in the environment overrides "level".
+# Returns the QueueListener, which is stopped, flushing the queue, at exit.
+def setup_logging(path=None, level=logging.INFO, console=True, rate=10, burst=20,
+        sample=100):
+    handlers = []
+    if path:
+        file_handler = logging.FileHandler(path)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(
+            logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        handlers.append(console_handler)
+
+    records = simple_queue()
+    queue_handler = LogQueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(rate, burst, sample))
+    listener = LogQueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    level = os.environ.get("LOG_LEVEL", level)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    return listener
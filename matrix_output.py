@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+
+from frame_output import FrameOutput
+
+logger = logging.getLogger(__name__)
+
+# Owns the matrix on a thread of its own, so SwapOnVSync never blocks the
+# asyncio loop. publish() converts the screen into one of two output buffers
+# and hands it over; the thread shows the most recent buffer handed over and
+# waits for vsync. If a newer frame is published before the thread got to the
+# pending one, the pending one is overwritten rather than queued, so the
+# matrix is never more than one frame behind.
+class MatrixOutput:
+    def __init__(self, matrix, size, rotation, canvas=None):
+        self.matrix = matrix
+        self.canvas = canvas or matrix.CreateFrameCanvas()
+        self.frame_output = FrameOutput(size, rotation, buffers=2)
+        self.condition = threading.Condition()
+        # Buffer the thread is showing, and buffer waiting to be shown.
+        self.front = 1
+        self.pending = None
+        self.running = False
+        self.thread = None
+        self.frames_published = 0
+        self.frames_shown = 0
+        self.frames_replaced = 0
+        # time.perf_counter() when the first frame reached the panel.
+        self.first_shown = None
+        # Number (counting publishes) of the frame in each buffer, and of the
+        # last frame shown and when, as time.monotonic().
+        self.slot_frames = [None, None]
+        self.shown_frame = None
+        self.shown_at = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="matrix-output", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+
+    def publish(self, screen):
+        with self.condition:
+            if self.pending is not None:
+                # Not shown yet: take it back and overwrite it.
+                slot, self.pending = self.pending, None
+                self.frames_replaced += 1
+            else:
+                slot = 1 - self.front
+        self.frame_output.render(screen, slot)
+        with self.condition:
+            self.pending = slot
+            self.frames_published += 1
+            self.slot_frames[slot] = self.frames_published
+            self.condition.notify()
+        return self.frames_published
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                self.front, self.pending = self.pending, None
+            try:
+                self.canvas.SetImage(self.frame_output.images[self.front])
+                self.canvas = self.matrix.SwapOnVSync(self.canvas)
+                self.shown_at = time.monotonic()
+                self.shown_frame = self.slot_frames[self.front]
+                self.frames_shown += 1
+                if self.first_shown is None:
+                    self.first_shown = time.perf_counter()
+            except Exception:
+                logger.exception("MatrixOutput: failed to show frame")
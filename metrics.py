@@ -0,0 +1,87 @@
+from bisect import bisect_left
+import os
+import time
+
+# Prometheus text-format metrics read straight from the counters the code
+# already keeps. Nothing is copied or locked when something happens: each
+# metric is a function that reads a plain number (or a dict of them, one per
+# label value) when /metrics is scraped. Every counter has a single writer,
+# so a scrape at worst sees a value one update old and never holds up the
+# render loop or a publisher.
+
+# Seconds, for frame and request times.
+DEFAULT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.016, 0.022, 0.033, 0.05, 0.1, 0.25, 1.0)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        # One more for values past the last bound (+Inf).
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current, in KiB on Linux and bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Metrics:
+    def __init__(self):
+        self.metrics = []
+
+    # read() returns a number, or {label value: number} if label is given.
+    def counter(self, name, help, read, label=None):
+        self.metrics.append((name, "counter", help, read, label))
+
+    def gauge(self, name, help, read, label=None):
+        self.metrics.append((name, "gauge", help, read, label))
+
+    def histogram(self, name, help, histogram):
+        self.metrics.append((name, "histogram", help, histogram, None))
+
+    def process(self):
+        self.gauge("process_resident_memory_bytes", "Resident memory size in bytes.",
+            resident_memory_bytes)
+        self.counter("process_cpu_seconds_total", "User and system CPU time in seconds.",
+            time.process_time)
+        return self
+
+    def render(self):
+        lines = []
+        for name, kind, help, read, label in self.metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(read.bounds + ("+Inf",), read.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum {read.sum}")
+                lines.append(f"{name}_count {read.count}")
+            elif label:
+                for value, number in read().items():
+                    lines.append(f'{name}{{{label}="{value}"}} {number}')
+            else:
+                lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+    # The same values as a dict, for humans.
+    def snapshot(self):
+        snapshot = {}
+        for name, kind, help, read, label in self.metrics:
+            if kind == "histogram":
+                snapshot[name] = {"count": read.count, "sum": read.sum}
+            else:
+                snapshot[name] = read()
+        return snapshot
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -1,31 +1,228 @@
-from aiohttp import web
 import asyncio
+from collections import Counter, deque
+import json
 import logging
-import pygame
+import time
 
-class Clock:
-    def __init__(self, time_func=pygame.time.get_ticks):
+from metrics import CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+# What FrameScheduler does when a frame starts after its deadline: run the
+# missed frames back to back to keep the average rate, or skip them and stay
+# on the original beat.
+CATCH_UP = "catch_up"
+SKIP = "skip"
+
+# Paces a frame loop against absolute deadlines on a monotonic clock, so
+# sleep overshoot never accumulates and the loop runs at "fps" on average.
+#
+# With idle_fps set, once idle_after seconds pass without a busy frame
+# (tick(busy=True)) the loop slows to idle_fps; a busy frame or wake(), e.g.
+# on input, brings it straight back to full rate, cutting the idle sleep
+# short.
+class FrameScheduler:
+    # Never catch up on more than this many seconds of missed frames.
+    MAX_BEHIND = 1.0
+
+    def __init__(self, fps, idle_fps=None, idle_after=1.0, policy=SKIP,
+            time_func=time.perf_counter, history=120):
+        self.fps = fps
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.policy = policy
         self.time_func = time_func
-        self.last_tick = time_func() or 0
+        self.deadline = None
+        self.last_busy = time_func()
+        self.last_frame = None
+        self.woken = asyncio.Event()
+        self.idle = False
+        self.frames = 0
+        self.late = 0
+        self.skipped = 0
+        self.wakes = 0
+        self.intervals = deque(maxlen=history)
+        self.errors = deque(maxlen=history)
 
-    async def tick(self, fps=0):
-        if 0 >= fps:
-            return
+    def wake(self):
+        self.last_busy = self.time_func()
+        if self.idle:
+            self.woken.set()
 
-        end_time = (1.0 / fps) * 1000
-        current = self.time_func()
-        time_diff = current - self.last_tick
-        delay = (end_time - time_diff) / 1000
+    async def tick(self, busy=False):
+        now = self.time_func()
+        if busy:
+            self.last_busy = now
+        self.idle = bool(self.idle_fps) and now - self.last_busy >= self.idle_after
+        period = 1 / (self.idle_fps if self.idle else self.fps)
+        self.deadline = (self.deadline or now) + period
+        if now > self.deadline:
+            self.late += 1
+            if self.policy == SKIP or now - self.deadline > FrameScheduler.MAX_BEHIND:
+                missed = int((now - self.deadline) / period) + 1
+                self.skipped += missed
+                self.deadline += missed * period
+        if self.deadline > now:
+            if self.idle:
+                self.woken.clear()
+                try:
+                    await asyncio.wait_for(self.woken.wait(), self.deadline - now)
+                    self.wakes += 1
+                    self.deadline = self.time_func()
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(self.deadline - now)
+        started = self.time_func()
+        self.errors.append(max(0, started - self.deadline))
+        if self.last_frame is not None:
+            self.intervals.append(started - self.last_frame)
+        self.last_frame = started
+        self.frames += 1
 
-        self.last_tick = current
-        if delay < 0:
-            delay = 0
+    # How late frames started after their deadlines, over the last "history"
+    # frames: the mean, p99 and max.
+    def stats(self):
+        elapsed = sum(self.intervals)
+        errors = sorted(self.errors)
+        return {"target_fps": self.idle_fps if self.idle else self.fps, "idle": self.idle,
+            "fps": round(len(self.intervals) / elapsed, 1) if elapsed else 0,
+            "mean_late_ms": round(sum(errors) * 1000 / len(errors), 2) if errors else 0,
+            "p99_late_ms": round(errors[min(len(errors) - 1, int(0.99 * len(errors)))] * 1000, 2)
+                if errors else 0,
+            "max_late_ms": round(errors[-1] * 1000, 2) if errors else 0,
+            "frames": self.frames, "late": self.late, "skipped": self.skipped,
+            "wakes": self.wakes}
 
-        await asyncio.sleep(delay)
+# Log2 buckets of durations in microseconds: bucket i counts durations
+# under 2**i us, the last one everything longer.
+class LatencyHistogram:
+    BUCKETS = 21
 
-class EventEngine:
     def __init__(self):
+        self.buckets = [0] * LatencyHistogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        self.buckets[min(us.bit_length(), LatencyHistogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+
+    # Upper bound, in us, of the bucket holding the p-th quantile.
+    def percentile(self, p):
+        target = p * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return 1 << i
+        return 0
+
+    def stats(self):
+        return {"count": self.count,
+            "mean_us": round(self.total * 1e6 / self.count, 1) if self.count else 0,
+            "p50_us": self.percentile(0.5), "p99_us": self.percentile(0.99),
+            "buckets": {f"<{1 << i}us": n for i, n in enumerate(self.buckets) if n}}
+
+# Policies for EventQueue: keep only the newest pending trigger of an event
+# (e.g. a redraw, where only the latest matters), or keep every one (game
+# logic, where each counts).
+COALESCE = "coalesce"
+PRESERVE = "preserve"
+
+# Triggers waiting for one coroutine listener, run by a worker task of its
+# own in order, each finishing before the next starts. However fast events
+# arrive the listener has one task and at most "capacity" pending triggers;
+# past that the oldest pending preserved trigger is dropped. A slow listener
+# (an HTTP request, say) only holds up its own triggers.
+#
+# The worker and its asyncio.Event are made on the first put(), so they
+# belong to the loop that is running then rather than whichever existed when
+# the queue was made.
+class EventQueue:
+    def __init__(self, engine, func, capacity=64, policies=None):
+        self.engine = engine
+        self.func = func
+        self.capacity = capacity
+        self.policies = policies or {}
+        # (event, args, kwargs, triggered at); coalesced events are queued
+        # once, with args None, and their newest arguments kept in "latest".
+        self.items = deque()
+        self.latest = {}
+        self.ready = None
+        self.worker = None
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, event, args, kwargs, triggered):
+        if self.policies.get(event, PRESERVE) == COALESCE:
+            queued = event in self.latest
+            self.latest[event] = (args, kwargs, triggered)
+            if queued:
+                self.coalesced += 1
+                return
+            self.items.append((event, None, None, None))
+        else:
+            self.items.append((event, args, kwargs, triggered))
+        if len(self.items) > self.capacity:
+            self._drop_oldest()
+        self.max_depth = max(self.max_depth, len(self.items))
+        if self.worker is None:
+            self.ready = asyncio.Event()
+            self.worker = asyncio.create_task(self._run())
+        self.ready.set()
+
+    # Coalesced events take one slot each however often they fire, so only
+    # preserved ones are dropped; the newest redraw is never lost.
+    def _drop_oldest(self):
+        for i, (event, args, kwargs, triggered) in enumerate(self.items):
+            if args is not None:
+                del self.items[i]
+                self.dropped += 1
+                return
+
+    async def _run(self):
+        while True:
+            if not self.items:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            event, args, kwargs, triggered = self.items.popleft()
+            if args is None:
+                args, kwargs, triggered = self.latest.pop(event)
+            await self.engine._call(self.func, event, args, kwargs, triggered)
+
+    def stats(self):
+        return {"depth": len(self.items), "max_depth": self.max_depth,
+            "dropped": self.dropped, "coalesced": self.coalesced}
+
+# Plain listeners run inside trigger(), in order; coroutine listeners (I/O)
+# each get a task, or, once bound(), their own EventQueue. The histogram
+# times each trigger to when its plain listeners returned, and again to when
+# each coroutine listener finished.
+class EventEngine:
+    def __init__(self, trace=False):
         self.listeners = {}
+        # event -> (plain functions, coroutine functions), rebuilt by on().
+        self.dispatch = {}
+        self.trace = trace
+        self.counts = Counter()
+        self.histogram = LatencyHistogram()
+        # Coroutine listener -> its EventQueue, once bound().
+        self.queues = None
+        self.capacity = None
+        self.policies = None
+
+    # From now on coroutine listeners' triggers are queued, a bounded
+    # EventQueue per listener, instead of each getting a task.
+    def bound(self, capacity=64, policies=None):
+        self.queues = {}
+        self.capacity = capacity
+        self.policies = policies
+        return self
 
     def on(self, event):
         if event not in self.listeners:
@@ -33,42 +230,115 @@ class EventEngine:
 
         def wrapper(func, *args):
             self.listeners[event].append(func)
+            self._compile(event)
             return func
 
         return wrapper
 
+    def _compile(self, event):
+        funcs = self.listeners[event]
+        self.dispatch[event] = (
+            tuple(f for f in funcs if not asyncio.iscoroutinefunction(f)),
+            tuple(f for f in funcs if asyncio.iscoroutinefunction(f)))
+
+    def _queue(self, func):
+        queue = self.queues.get(func)
+        if queue is None:
+            queue = self.queues[func] = EventQueue(self, func, self.capacity, self.policies)
+        return queue
+
+    async def _call(self, func, event, args, kwargs, triggered):
+        try:
+            await func(*args, **kwargs)
+        except Exception:
+            logger.exception(f"trigger: {event} listener {func.__qualname__} failed")
+        self.histogram.add(time.perf_counter() - triggered)
+
     # this function is purposefully not async
     # code calling this will do so in a "fire-and-forget" manner, and shouldn't be
-    # slowed down by needing to await a result
+    # slowed down by needing to await a result. Plain listeners run right here;
+    # coroutine listeners are handed to a task or their queue.
     def trigger(self, event, *args, **kwargs):
-        print(f"eventengine trigger {event}, {args}")
-        asyncio.create_task(self.async_trigger(event, *args, **kwargs))
+        started = time.perf_counter()
+        try:
+            funcs, coroutine_funcs = self.dispatch[event]
+        except KeyError:
+            self.counts["unhandled"] += 1
+            logger.warning("trigger: no listener for %s", event)
+            return
+        if self.trace:
+            logger.debug("trigger: %s %s %s", event, args, kwargs)
+        for func in funcs:
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception(f"trigger: {event} listener {func.__qualname__} failed")
+        if funcs:
+            self.histogram.add(time.perf_counter() - started)
+        for func in coroutine_funcs:
+            if self.queues is not None:
+                self._queue(func).put(event, args, kwargs, started)
+            else:
+                asyncio.create_task(self._call(func, event, args, kwargs, started))
+        self.counts[event] += 1
 
-    # whatever gets triggered is just added to the current asyncio event loop,
-    # which we then trust to run eventually
+    # Like trigger, but waits for the coroutine listeners to finish.
     async def async_trigger(self, event, *args, **kwargs):
-        logging.info(f"async_trigger: {event}, {self.listeners}")
-        print(f"async_trigger: {event}, {self.listeners}")
-        if event in self.listeners:
-            print(f"in list: {event}")
-            handlers = [func(*args, **kwargs) for func in self.listeners[event]]
-            print(f"handlers: {handlers}")
-            # schedule all listeners to run
-            return await asyncio.gather(*handlers)
-        else:
-            raise Exception(f"async_trigger: no event {event} in {self.listeners}")
+        if event not in self.dispatch:
+            raise Exception(f"async_trigger: no event {event} in {list(self.listeners)}")
+        if self.trace:
+            logger.debug("async_trigger: %s %s %s", event, args, kwargs)
+        funcs, coroutine_funcs = self.dispatch[event]
+        self.counts[event] += 1
+        results = [func(*args, **kwargs) for func in funcs]
+        return results + await asyncio.gather(*(f(*args, **kwargs) for f in coroutine_funcs))
+
+    # Triggers waiting in every listener's queue, and dropped from them.
+    def queue_depth(self):
+        return sum(len(queue.items) for queue in (self.queues or {}).values())
+
+    def queue_dropped(self):
+        return sum(queue.dropped for queue in (self.queues or {}).values())
 
+    def stats(self):
+        stats = {"events": dict(self.counts), "dispatch": self.histogram.stats()}
+        if self.queues is not None:
+            stats["queues"] = {func.__qualname__: queue.stats()
+                for func, queue in self.queues.items()}
+        return stats
 
+
+# A small HTTP server on the display's event loop. Given a metrics.Metrics
+# it serves them at /metrics, in Prometheus text format, and as JSON at
+# /stats; add_json serves anything else.
 class WebFrontend:
-    def __init__(self, port=8081):
+    def __init__(self, port=8081, host="localhost", metrics=None):
+        # aiohttp's server is only loaded by the processes that serve.
+        from aiohttp import web
+        self.web = web
         self.port = port
+        self.host = host
         self.runner = None
         self.app = web.Application()
+        self.metrics = metrics
+        if metrics:
+            self.app.router.add_get("/metrics", self.get_metrics)
+            self.add_json("/stats", metrics.snapshot)
+
+    async def get_metrics(self, request):
+        return self.web.Response(text=self.metrics.render(),
+            headers={"Content-Type": CONTENT_TYPE})
+
+    # Serves read() as JSON at path.
+    def add_json(self, path, read):
+        async def get(request):
+            return self.web.json_response(read(), dumps=lambda o: json.dumps(o, default=repr))
+        self.app.router.add_get(path, get)
 
     async def startup(self):
-        self.runner = web.AppRunner(self.app)
+        self.runner = self.web.AppRunner(self.app)
         await self.runner.setup()
-        site = web.TCPSite(self.runner, "localhost", self.port)
+        site = self.web.TCPSite(self.runner, self.host, self.port)
         await site.start()
 
     async def shutdown(self):
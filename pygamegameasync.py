@@ -2,65 +2,80 @@
 
 # From https://python-forum.io/thread-23029.html
 
-import platform
-if platform.system() != "Darwin":
-    from rgbmatrix import graphics
-    from rgbmatrix import RGBMatrix, RGBMatrixOptions
-    from runtext import RunText
-import aiohttp
+# Started before anything slow is imported, so the startup timeline counts
+# the imports too. rgbmatrix, aiohttp, PIL and numpy are only imported once
+# something is on screen, if they're needed at all.
+from timeline import Timeline
+timeline = Timeline("display")
+
+import argparse
 import asyncio
 import json
 import logging
 import os
-from PIL import Image
 import pygame
 from pygame import Color
-from pygame.image import tobytes as image_to_string
 import pygame.freetype as ft
 import random
 import string
 import sys
 import time
 
-from cube_async import get_sse_messages, trigger_events_from_sse
-from pygameasync import Clock, EventEngine
-from session import get as session_get
+from answer_atlas import AnswerAtlas
+from cube_async import SseSubscriber, dispatch_events_from_sse
+from decks import DeckIndex
+from displays import open_displays, use_headless_driver
+from journal import Journal
+from log_pipeline import setup_logging
+from metrics import Histogram, Metrics
+from pygameasync import COALESCE, EventEngine, FrameScheduler, WebFrontend
+from session import get as session_get, wait_until_ready
+from text_cache import TextCache
+from tracing import Tracer, stamp
 
 logger = logging.getLogger(__name__)
 
-ch = logging.StreamHandler()
-logging.basicConfig(filename="password.log")
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
-
-events = EventEngine()
+# Each coroutine listener has one worker running its triggers in order, so
+# an input storm or a replay burst can't pile up tasks, and a slow request to
+# app.py never holds up a delta; repeated push_starts collapse into one
+# redraw.
+events = EventEngine().bound(capacity=64, policies={"game.push_start": COALESCE})
 
 SCREEN_WIDTH = 192
 SCREEN_HEIGHT = 256
 SCALING_FACTOR = 3
 
 TICKS_PER_SECOND = 45
+# Frame rate once nothing has changed for a second; pushed events and key
+# presses bring it straight back to TICKS_PER_SECOND.
+IDLE_TICKS_PER_SECOND = 10
+
+USE_ANSWER_ATLAS = True
+
+# Where /metrics and /stats are served (see pygameasync.WebFrontend). Only
+# to this machine unless METRICS_HOST says otherwise, e.g. 0.0.0.0 for a
+# Prometheus elsewhere.
+METRICS_HOST = os.environ.get("METRICS_HOST", "localhost")
+METRICS_PORT = 8081
+
+# Where the start/next buttons are plugged in, if they are (see
+# serial_input.py).
+SERIAL_PORT = os.environ.get("SERIAL_PORT")
 
 offscreen_canvas = None
 
 game_name = "password"
 
-def render_text(font, surface, text, color):
-    words = text.split(' ')
-    w, h = surface.get_size()
-    line_spacing = font.get_sized_height() + 2
-    x, y = 0, line_spacing
-    space = font.get_rect(' ')
-
-    for word in words:
-        bounds = font.get_rect(word)
-        if x + bounds.width + bounds.x >= w:
-            x, y = 0, y + line_spacing
-        font.render_to(surface, (x, y - bounds.y), None, color)
-        x += bounds.width + space.width
+# The state this display last showed, so a restart shows it straight away
+# instead of "ANSWER" until app.py answers.
+DISPLAY_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "display_journal.jsonl")
 
+text_cache = TextCache()
+
+def render_text(font, surface, text, color):
+    block, y = text_cache.layout(font, text, color, surface.get_width())
+    surface.blit(block, (0, 0))
     return y
 
 class Title:
@@ -69,9 +84,15 @@ class Title:
     def __init__(self, font, width, height):
         self.font = font
         self.surface = pygame.Surface((width, height))
+        self.dirty = False
 
     def draw(self):
-        self.font.render_to(self.surface, (0, 0), game_name.upper(), "green", size=Title.LETTER_SIZE)
+        text, _ = text_cache.render(self.font, game_name.upper(), "green", Title.LETTER_SIZE)
+        self.surface.blit(text, (0, 0))
+        self.dirty = True
+
+    def rect(self, pos):
+        return self.surface.get_rect(topleft=pos)
 
     def update(self, window, pos):
         window.blit(self.surface, pos)
@@ -84,12 +105,19 @@ class Answer:
         self.font = font
         self.surface = pygame.Surface((width, height))
         self.answer = "ANSWER"
+        self.atlas = None
+        self.dirty = False
 
     def draw(self):
         self.surface.fill((0, 0, 0))
-        _, r = self.font.render(self.answer, size=Answer.LETTER_SIZE)
-        self.font.render_to(self.surface, (int((SCREEN_WIDTH - r.width)/2), 0), self.answer,
-            fgcolor="red", size=Answer.LETTER_SIZE)
+        text = self.atlas.get(self.answer) if self.atlas else None
+        if text is None:
+            text, _ = text_cache.render(self.font, self.answer, "red", Answer.LETTER_SIZE)
+        self.surface.blit(text, (int((SCREEN_WIDTH - text.get_width())/2), 0))
+        self.dirty = True
+
+    def rect(self, pos):
+        return self.surface.get_rect(topleft=pos)
 
     def update(self, window, pos):
         window.blit(self.surface, pos)
@@ -103,27 +131,37 @@ class Instructions:
         self.surface = pygame.Surface((width, height))
         with open(f"{game_name}_instructions.txt", "r") as file:
             self.text = file.read().rstrip()
+        self.height = 0
+        self.dirty = False
 
     def draw(self):
         self.font.size = Instructions.LETTER_SIZE
         self.height = render_text(self.font, self.surface, self.text,  "white")
-        print(f"height {self.height}")
+        logger.debug("height %s", self.height)
+        self.dirty = True
+
+    def rect(self, pos):
+        return self.surface.get_rect(topleft=(pos[0], pos[1]-self.height))
 
     def update(self, window, pos):
-        pos = (pos[0], pos[1]-self.height)
-        window.blit(self.surface, pos)
+        window.blit(self.surface, self.rect(pos))
 
+# Shows the game app.py owns: answers, score and round arrive as a snapshot
+# when the SSE stream connects and as deltas after that (see game_state.py).
 class Game:
-    def __init__(self, session):
-        self.all_words = []
-        with open("./allwords.txt", 'r') as f:
-            lines = f.readlines()
-        self.all_words.extend([line.strip().upper() for line in lines])
+    def __init__(self, session, journal=None):
+        self.state = {}
+        # Traces (see tracing.py) of deltas not drawn yet, and of those the
+        # last update drew.
+        self.traces = []
+        self.drawn = []
+        self.journal = journal
 
         self._session = session
         events.on(f"game.push_start")(self.start)
-        events.on(f"game.push_next_answer")(self.next_answer)
+        events.on(f"game.push_state")(self.apply_state)
         events.on(f"game.push_shutdown")(self.shutdown)
+        events.on(f"game.request")(self.request)
         answer_font = pygame.freetype.Font(os.path.join(os.path.dirname(os.path.abspath(__file__)),
             "Courier New.ttf"))
         font = pygame.freetype.Font(os.path.join(os.path.dirname(os.path.abspath(__file__)),
@@ -131,108 +169,295 @@ class Game:
         self.title_display = Title(font, SCREEN_WIDTH, int(SCREEN_HEIGHT/10))
         self.instructions_display = Instructions(font, SCREEN_WIDTH, int(SCREEN_HEIGHT/2))
         self.answer_display = Answer(answer_font, SCREEN_WIDTH, int(SCREEN_HEIGHT/10))
-        self.dirty = True
 
     def draw(self):
-        print("drawing")
+        logger.debug("drawing")
         self.answer_display.draw()
-        self.dirty = True
 
     async def start(self):
-        self.answers = list(self.all_words)
-        random.shuffle(self.answers)
-
-        self.answer_display.answer = self.answers.pop()
         self.title_display.draw()
         self.instructions_display.draw()
         self.draw()
+        logger.info("text cache: %s", text_cache.stats())
+
+    # Loads the last state this display showed from its journal.
+    def restore(self):
+        started = time.perf_counter()
+        state, records = self.journal.load()
+        self.state = state or {}
+        for record in records:
+            self.state.update(record["delta"])
+        if "answer" in self.state:
+            self.answer_display.answer = self.state["answer"]
+        logger.info("restored %s from %d records in %.1f ms", self.state, len(records),
+            (time.perf_counter() - started) * 1000)
+
+    # Runs inline as each delta arrives (see EventEngine.trigger).
+    def apply_state(self, delta):
+        trace = delta.pop("trace", None)
+        if trace:
+            stamp(trace, "applied")
+            self.traces.append(trace)
+        self.state.update(delta)
+        if self.journal:
+            self.journal.append({"type": "state", "delta": delta})
+            if self.journal.needs_snapshot():
+                self.journal.snapshot(self.state)
+        if "answer" in delta:
+            self.answer_display.answer = delta["answer"]
+            self.draw()
 
     async def stop(self):
         return await session_get(self._session, "stop")
 
+    # Asks app.py to change the game, e.g. "start" or "next_answer"; the
+    # change comes back, to every display, as a push_state delta.
+    async def request(self, url):
+        try:
+            await session_get(self._session, url)
+        except Exception as e:
+            logger.warning(f"request {url} failed: {e!r}")
+
+    # Pre-renders every answer (or loads them from disk) in the background;
+    # until it's ready answers are rendered as they come up. The word lists
+    # are loaded on a thread, so they don't hold up the first frame. Lists
+    # too long for an atlas are left to text_cache, which keeps only the
+    # answers shown recently.
+    async def load_atlas(self):
+        decks = await asyncio.to_thread(DeckIndex.open_default)
+        count = sum(len(store) for store in decks.stores.values())
+        if count >= AnswerAtlas.MAX_WORDS:
+            logger.info("load_atlas: %d words is too many for an atlas", count)
+            return
+        atlas = AnswerAtlas(self.answer_display.font, Answer.LETTER_SIZE, "red",
+            list(decks.words()) + ["GAME OVER"])
+        await atlas.load_or_build()
+        self.answer_display.atlas = atlas
+
+    # Displays and their positions, bottom to top, as they may overlap.
+    def layers(self):
+        return [(self.instructions_display, (0, SCREEN_HEIGHT-5)),
+                (self.title_display, (0, 0)),
+                (self.answer_display, (0, SCREEN_HEIGHT/2 - 20))]
+
+    # Blits whatever was redrawn since the last update, plus anything stacked
+    # on top of it, and returns the damaged rectangles (empty if nothing
+    # changed).
     async def update(self, window):
-        if self.dirty:
-            print("updating")
-            self.instructions_display.update(window, (0, SCREEN_HEIGHT-5))
-            self.title_display.update(window, (0, 0))
-            self.answer_display.update(window, (0, SCREEN_HEIGHT/2 - 20))
-            # self.instructions_display.update(window, (0, 0))
-            self.dirty = False
+        layers = self.layers()
+        damaged = [display.rect(pos).clip(window.get_rect())
+            for display, pos in layers if display.dirty]
+        if not damaged:
+            return []
+        logger.debug("updating")
+        for display, pos in layers:
+            if display.dirty or display.rect(pos).collidelist(damaged) >= 0:
+                display.update(window, pos)
+                display.dirty = False
+        for trace in self.traces:
+            stamp(trace, "drawn")
+        self.drawn, self.traces = self.traces, []
+        return damaged
 
     async def shutdown(self, shutdown_now):
-        print(f"exiting: {shutdown_now}")
+        logger.info("exiting: %s", shutdown_now)
         if shutdown_now[0]:
             sys.exit(0)
 
-    async def next_answer(self):
-        self.answer_display.answer = self.answers.pop() if self.answers else "GAME OVER"
-        self.draw()
-
-async def main():
-    global game_name
-    start = True
-    window = pygame.display.set_mode(
-        (SCREEN_WIDTH*SCALING_FACTOR, SCREEN_HEIGHT*SCALING_FACTOR))
-    screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-    if platform.system() != "Darwin":
+# The command line: RunText's matrix options plus --game and --display, or
+# just those two without rgbmatrix. The game can also be given on its own,
+# as it used to be.
+def parse_args():
+    try:
+        from runtext import RunText
+    except ImportError:  # No rgbmatrix: a desktop or a CI box.
+        RunText = None
+    if RunText:
         run_text = RunText()
+        return run_text.parser.parse_args(), run_text
+    parser = argparse.ArgumentParser()
+    parser.add_argument("game_name", nargs="?", help=argparse.SUPPRESS)
+    parser.add_argument("--game", help="Name of the game", type=str)
+    parser.add_argument("--display", help="Comma-separated displays: window, null, "
+        "recorder. Default: window", default="window", type=str)
+    args = parser.parse_args()
+    args.game = args.game or args.game_name
+    return args, None
+
+# Lights every display before fonts, words or app.py are loaded, so the
+# panel isn't dark while the rest starts up.
+def show_placeholder(screen, displays):
+    screen.fill((0, 0, 0))
+    pygame.draw.rect(screen, (0, 64, 0), screen.get_rect(), 1)
+    for display in displays:
+        display.show(screen, [screen.get_rect()])
+
+# What the display's /metrics reports; each value is read when scraped.
+def display_metrics(clock, subscriber, frame_times):
+    metrics = Metrics().process()
+    metrics.histogram("display_frame_seconds", "Time to draw and show a frame that changed.", frame_times)
+    metrics.gauge("display_fps", "Frames per second over the last few seconds.",
+        lambda: clock.stats()["fps"])
+    metrics.gauge("display_target_fps", "Frame rate aimed for, full or idle.",
+        lambda: clock.idle_fps if clock.idle else clock.fps)
+    metrics.counter("display_frames_total", "Frames run.", lambda: clock.frames)
+    metrics.counter("display_late_frames_total", "Frames started after their deadline.",
+        lambda: clock.late)
+    metrics.counter("display_sse_events_received_total", "Events received from app.py.",
+        lambda: subscriber.events_received)
+    metrics.counter("display_sse_reconnects_total", "Reconnections to app.py.",
+        lambda: subscriber.reconnects)
+    metrics.counter("display_events_total", "Events dispatched, per event.",
+        lambda: events.counts, "event")
+    metrics.gauge("display_event_queue_depth", "Events waiting for their listeners.",
+        events.queue_depth)
+    metrics.counter("display_event_queue_dropped_total", "Events dropped from a full queue.",
+        events.queue_dropped)
+    return metrics
+
+async def connect(session, subscriber):
+    await wait_until_ready(session)
+    timeline.mark("app.py ready")
+    await dispatch_events_from_sse(subscriber, events, "game.")
+
+async def main(args, run_text=None):
+    screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    def matrix():
+        if not run_text:
+            raise ValueError("the matrix display needs rgbmatrix")
         run_text.process()
-        game_name = run_text.args.game
-        matrix = run_text.matrix
-        offscreen_canvas = matrix.CreateFrameCanvas()
-
-    clock = Clock()
-    async with aiohttp.ClientSession(
-        timeout = aiohttp.ClientTimeout(total=60*60*24*7)) as session:
-        game = Game(session)
+        return run_text.matrix
+    displays = open_displays(args.display, (SCREEN_WIDTH, SCREEN_HEIGHT), SCALING_FACTOR,
+        -90, matrix)
+    timeline.mark("displays open")
+    show_placeholder(screen, displays)
+    timeline.mark("placeholder shown")
+
+    import aiohttp
+    timeline.mark("aiohttp imported")
+    clock = FrameScheduler(TICKS_PER_SECOND, idle_fps=IDLE_TICKS_PER_SECOND)
+    # One pooled connector for the SSE stream and every request to app.py.
+    # sock_read notices a dead server within a few of its 15s keepalives.
+    connector = aiohttp.TCPConnector(limit_per_host=4, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector,
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=45)) as session:
+        game = Game(session, Journal(DISPLAY_JOURNAL_PATH))
+        game.restore()
+        game.journal.open()
+        timeline.mark("fonts and journal loaded")
+        subscriber = SseSubscriber(session,
+            "http://localhost:8080/push?channels=push_start,push_state,push_shutdown")
         tasks = []
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_start",
-                "http://localhost:8080/push_start")))
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_next_answer",
-                "http://localhost:8080/push_next_answer")))
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_shutdown",
-                "http://localhost:8080/push_shutdown")))
+        tasks.append(asyncio.create_task(connect(session, subscriber)))
+        if USE_ANSWER_ATLAS:
+            tasks.append(asyncio.create_task(game.load_atlas()))
+        for event in ("game.push_start", "game.push_state", "game.request"):
+            events.on(event)(lambda *args: clock.wake())
+        events.on("game.push_state")(lambda *args: timeline.mark("first push_state"))
+        frame_times = Histogram()
+        tracer = Tracer()
+        matrix_output = next((display.output for display in displays
+            if display.name == "matrix"), None)
+        frontend = WebFrontend(METRICS_PORT, METRICS_HOST,
+            display_metrics(clock, subscriber, frame_times))
+        frontend.add_json("/traces", tracer.stats)
+        try:
+            await frontend.startup()
+        except OSError as e:
+            logger.warning("no metrics server on %s:%d: %s", METRICS_HOST, METRICS_PORT, e)
+        serial_input = None
+        if SERIAL_PORT:
+            from serial_input import SerialInput, open_serial
+            try:
+                reader, serial_device = await open_serial(SERIAL_PORT)
+            except (OSError, ValueError) as e:
+                logger.warning("no serial input from %s: %s", SERIAL_PORT, e)
+            else:
+                serial_input = SerialInput(reader, events)
+                tasks.append(asyncio.create_task(serial_input.run()))
 
         await game.start()
         game.draw()
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return
-                if event.type == pygame.KEYDOWN:
-                    key = pygame.key.name(event.key).upper()
-                    # logger.info(f"key: {key}")
-                    if key == "SPACE":
-                        await game.start()
-                    elif key == "RETURN":
-                        print(f"RETURN")
-                        await game.next_answer()
-                        game.draw()
-            await game.update(screen)
-            if platform.system() != "Darwin":
-                pixels = image_to_string(screen, "RGB")
-                img = Image.frombytes("RGB", (screen.get_width(), screen.get_height()), pixels)
-                img = img.rotate(-90, Image.NEAREST, expand=1)
-                offscreen_canvas.SetImage(img)
-                matrix.SwapOnVSync(offscreen_canvas)
-            window.blit(pygame.transform.scale(screen, window.get_rect().size), (0, 0))
-            pygame.display.flip()
-            await clock.tick(TICKS_PER_SECOND)
-
-        for t in tasks:
-            t.cancel()
+        # The placeholder's border is outside what the game draws.
+        screen.fill((0, 0, 0))
+        exposed = True
+        try:
+            while True:
+                pressed = False
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        return
+                    if event.type == pygame.WINDOWEXPOSED:
+                        exposed = True
+                    if event.type == pygame.KEYDOWN:
+                        pressed = True
+                        key = pygame.key.name(event.key).upper()
+                        # logger.info(f"key: {key}")
+                        if key == "SPACE":
+                            events.trigger("game.request", "start")
+                        elif key == "RETURN":
+                            events.trigger("game.request", "next_answer")
+                # Nothing is pushed to a display unless it changed.
+                started = time.perf_counter()
+                damaged = await game.update(screen)
+                for display in displays:
+                    display.show(screen, damaged, exposed)
+                if damaged:
+                    frame_times.observe(time.perf_counter() - started)
+                    for trace in game.drawn:
+                        stamp(trace, "shown")
+                        if matrix_output:
+                            tracer.wait_for_swap(trace, matrix_output.frames_published)
+                        else:
+                            tracer.finish(trace)
+                    game.drawn = []
+                if damaged and serial_input:
+                    serial_input.frame_shown(
+                        matrix_output.frames_published if matrix_output else None)
+                if matrix_output:
+                    tracer.swapped(matrix_output.shown_frame, matrix_output.shown_at)
+                    if serial_input:
+                        serial_input.swapped(matrix_output.shown_frame, matrix_output.shown_at)
+                exposed = False
+                if damaged and "first frame" not in timeline.marks:
+                    timeline.mark("first frame")
+                    try:
+                        pygame.mixer.init(22050)
+                    except pygame.error as e:
+                        logger.warning(f"no sound: {e}")
+                if damaged and "first push_state" in timeline.marks and not timeline.reported:
+                    timeline.mark("first live frame")
+                    for display in displays:
+                        # None if the display hasn't shown a frame yet.
+                        first_pixel = display.first_pixel()
+                        if first_pixel is not None:
+                            timeline.mark(f"first pixel ({display.name})", first_pixel)
+                    logger.info(timeline.report())
+                await clock.tick(busy=bool(damaged) or pressed)
+        finally:
+            for t in tasks:
+                t.cancel()
+            logger.info(f"events: {events.stats()}")
+            logger.info(f"frames: {clock.stats()}")
+            logger.info(f"displays: {[display.stats() for display in displays]}")
+            logger.info(f"traces: {tracer.stats()}")
+            if serial_input:
+                logger.info(f"serial input: {serial_input.stats()}")
+            for display in displays:
+                display.close()
+            game.journal.close()
+            await frontend.shutdown()
 
 if __name__ == "__main__":
-    logger.setLevel(logging.DEBUG)
-    if len(sys.argv) > 1:
-        game_name = sys.argv[1]
-    pygame.mixer.init(22050)
-    logger.info("pygame.init()")
-    pygame.init()
+    setup_logging("password.log")
+    args, run_text = parse_args()
+    game_name = args.game or game_name
+    use_headless_driver(args.display)
+    timeline.mark("imports")
+    # Only what's needed to draw; the mixer, which opens the sound card, waits
+    # for the first frame.
+    pygame.display.init()
     pygame.freetype.init()
-    logger.info("pygame.init() done")
-    asyncio.run(main())
+    timeline.mark("pygame.init() done")
+    asyncio.run(main(args, run_text))
     pygame.quit()
@@ -11,16 +11,15 @@ import aiohttp
 import asyncio
 import json
 import logging
-from PIL import Image
 import pygame
 from pygame import Color
-from pygame.image import tobytes as image_to_string
 import string
 import sys
 import time
 
-from cube_async import get_sse_messages, trigger_events_from_sse
-from pygameasync import Clock, EventEngine
+from cube_async import SseSubscriber, trigger_events_from_sse
+from matrix_output import MatrixOutput
+from pygameasync import EventEngine, FrameScheduler
 from session import get as session_get
 
 logger = logging.getLogger(__name__)
@@ -195,27 +194,26 @@ async def main():
         my_text = "wordle loading..."
         graphics.DrawText(offscreen_canvas, font, pos, 10, textColor, my_text)
         offscreen_canvas = matrix.SwapOnVSync(offscreen_canvas)
-
-    clock = Clock()
-    async with aiohttp.ClientSession(
-        timeout = aiohttp.ClientTimeout(total=60*60*24*7)) as session:
+        matrix_output = MatrixOutput(matrix, (SCREEN_WIDTH, SCREEN_HEIGHT), 90, offscreen_canvas)
+        matrix_output.start()
+
+    clock = FrameScheduler(TICKS_PER_SECOND)
+    # One pooled connector for the SSE streams and every request to the
+    # server. sock_read notices a dead server within a few of its 15s
+    # keepalives. The wordle server has no /push, so each channel has its own
+    # stream.
+    connector = aiohttp.TCPConnector(limit_per_host=8, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector,
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=45)) as session:
         game = Game(session)
         tasks = []
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_start",
-                "http://localhost:8080/push_start")))
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.guesses_and_colors",
-                "http://localhost:8080/push_guesses_and_colors")))
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_current_letter",
-                "http://localhost:8080/push_current_letter")))
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_guess_current",
-                "http://localhost:8080/push_guess_current")))
-        tasks.append(asyncio.create_task(
-            trigger_events_from_sse(session, events, "game.push_shutdown",
-                "http://localhost:8080/push_shutdown")))
+        for event, channel in (("game.push_start", "push_start"),
+                ("game.guesses_and_colors", "push_guesses_and_colors"),
+                ("game.push_current_letter", "push_current_letter"),
+                ("game.push_guess_current", "push_guess_current"),
+                ("game.push_shutdown", "push_shutdown")):
+            subscriber = SseSubscriber(session, f"http://localhost:8080/{channel}")
+            tasks.append(asyncio.create_task(trigger_events_from_sse(subscriber, events, event)))
 
         await game.start()
         game.draw()
@@ -244,14 +242,10 @@ async def main():
                     await game.update(screen)
 
             if platform.system() != "Darwin":
-                pixels = image_to_string(screen, "RGB")
-                img = Image.frombytes("RGB", (screen.get_width(), screen.get_height()), pixels)
-                img = img.rotate(90, Image.NEAREST, expand=1)
-                offscreen_canvas.SetImage(img)
-                matrix.SwapOnVSync(offscreen_canvas)
+                matrix_output.publish(screen)
             window.blit(pygame.transform.scale(screen, window.get_rect().size), (0, 0))
             pygame.display.flip()
-            await clock.tick(TICKS_PER_SECOND)
+            await clock.tick()
 
         for t in tasks:
             t.cancel()
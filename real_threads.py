@@ -0,0 +1,34 @@
+import sys
+import threading
+
+# Real OS threads and the locks and queues to talk to them, even in a process
+# gevent has monkey-patched (app.py). There threading.Thread is a greenlet,
+# so a blocking write or fsync on it would stop every request.
+
+# gevent's monkey module if it has patched threading, else None.
+def gevent_monkey():
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey if monkey and monkey.is_module_patched("threading") else None
+
+def allocate_lock():
+    monkey = gevent_monkey()
+    if monkey:
+        return monkey.get_original("_thread", "allocate_lock")()
+    return threading.Lock()
+
+def simple_queue():
+    monkey = gevent_monkey()
+    if monkey:
+        return monkey.get_original("queue", "SimpleQueue")()
+    import queue
+    return queue.SimpleQueue()
+
+# Runs target on a real thread, from gevent's threadpool under gevent, and
+# returns a function that waits for it to finish.
+def start_thread(target, name):
+    if gevent_monkey():
+        import gevent
+        return gevent.get_hub().threadpool.spawn(target).get
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread.join
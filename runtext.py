@@ -9,6 +9,7 @@ class RunText(SampleBase):
     def __init__(self, *args, **kwargs):
         super(RunText, self).__init__(*args, **kwargs)
         self.parser.add_argument("--game", help="Name of the game", action='store', type=str)
+        self.parser.add_argument("--display", help="Comma-separated displays: window, matrix, null, recorder. Default: window,matrix", action='store', default="window,matrix", type=str)
 
 
 # Main function
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import asyncio
+from collections import Counter, deque
+import logging
+import os
+import pty
+import serial
+import sys
+import time
+import tty
+
+from cube_async import get_serial_messages
+
+logger = logging.getLogger(__name__)
+
+# What each button sends, one per line, mapped to the app.py request it
+# makes; the same requests the keyboard makes.
+BUTTONS = {"start": "start", "next": "next_answer", "next_answer": "next_answer",
+    "correct": "correct"}
+
+# Opens a serial port (or the pty of a FakeSerial) as an asyncio
+# StreamReader. The Serial object is returned too, to keep it open.
+async def open_serial(port, baudrate=115200):
+    device = serial.Serial(port, baudrate, timeout=0)
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), device)
+    return reader, device
+
+# Buttons wired to a microcontroller that writes a line to the serial port
+# for each press. Presses are triggered on the EventEngine as "request"
+# events, like the keyboard's, as soon as their line arrives.
+#
+# A line repeated within "debounce" seconds of the last time it was seen is
+# switch bounce and dropped; after a press is accepted others are dropped
+# for "min_interval" seconds so a held or mashed button can't flood app.py.
+#
+# Each accepted press waits for the next frame the display draws
+# (frame_shown). With a matrix it then waits for the matrix to swap that
+# frame in (swapped); without one the window frame is as far as it goes. The
+# time from its line arriving to then is kept as its latency, in ms.
+class SerialInput:
+    def __init__(self, reader, events, prefix="game.", debounce=0.05, min_interval=0.25,
+            buttons=BUTTONS, history=256):
+        self.reader = reader
+        self.events = events
+        self.prefix = prefix
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.buttons = buttons
+        self.last_seen = {}
+        self.last_accepted = None
+        self.waiting = []
+        # (time pressed, matrix frame number) for presses drawn but not shown.
+        self.in_flight = []
+        self.latencies = deque(maxlen=history)
+        self.counts = Counter()
+
+    # Returns the request for line, or None if it is dropped.
+    def accept(self, line, now):
+        line = line.strip().lower()
+        request = self.buttons.get(line)
+        if request is None:
+            self.counts["unknown"] += 1
+            return None
+        last_seen, self.last_seen[line] = self.last_seen.get(line), now
+        if last_seen is not None and now - last_seen < self.debounce:
+            self.counts["bounced"] += 1
+            return None
+        if self.last_accepted is not None and now - self.last_accepted < self.min_interval:
+            self.counts["limited"] += 1
+            return None
+        self.last_accepted = now
+        self.counts["accepted"] += 1
+        return request
+
+    async def run(self):
+        try:
+            async for line in get_serial_messages(self.reader):
+                now = time.monotonic()
+                if not line:
+                    continue
+                request = self.accept(line, now)
+                if request is None:
+                    logger.debug("SerialInput: dropped %r", line)
+                    continue
+                self.waiting.append(now)
+                self.events.trigger(f"{self.prefix}request", request)
+        except asyncio.IncompleteReadError:
+            logger.warning("SerialInput: serial port closed")
+        except asyncio.LimitOverrunError as e:
+            logger.warning("SerialInput: line too long: %s", e)
+
+    # A frame with every press so far was drawn and went to the displays: to
+    # the matrix as frame number "frame", or, with no matrix (None), to the
+    # window just now.
+    def frame_shown(self, frame=None):
+        if not self.waiting:
+            return
+        if frame is None:
+            now = time.monotonic()
+            for pressed in self.waiting:
+                self.latencies.append((now - pressed) * 1000)
+        else:
+            self.in_flight.extend((pressed, frame) for pressed in self.waiting)
+        self.waiting.clear()
+
+    # The matrix showed frame number "frame" (or a later one) at "at", a
+    # time.monotonic() value.
+    def swapped(self, frame, at):
+        if not self.in_flight or frame is None:
+            return
+        still_in_flight = []
+        for pressed, waiting_for in self.in_flight:
+            if waiting_for <= frame:
+                self.latencies.append((at - pressed) * 1000)
+            else:
+                still_in_flight.append((pressed, waiting_for))
+        self.in_flight = still_in_flight
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2)
+        stats = dict(self.counts)
+        if latencies:
+            stats.update(latency_p50_ms=percentile(0.5), latency_p99_ms=percentile(0.99),
+                latency_max_ms=round(latencies[-1], 2))
+        return stats
+
+# A pseudo-terminal standing in for the button board: open_serial(port)
+# reads what press() writes, so the serial path runs without hardware.
+class FakeSerial:
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def press(self, button):
+        os.write(self.master, f"{button}\n".encode())
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+# Relays lines typed here to a FakeSerial, e.g.
+#   ./serial_input.py
+#   SERIAL_PORT=/dev/pts/N ./pygamegameasync.py
+if __name__ == "__main__":
+    fake = FakeSerial()
+    print(f"serial port: {fake.port}; type {', '.join(BUTTONS)}", flush=True)
+    for line in sys.stdin:
+        fake.press(line.strip())
+    fake.close()
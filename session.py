@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,3 +23,13 @@ class SafeSession:
 async def get(session, url, params={}):
     async with SafeSession(session.get(base_url + url, params=params)) as response:
         return (await response.content.read()).decode()
+
+# Waits until app.py answers /ready, polling every "interval" seconds, so a
+# display started alongside it connects as soon as it's up rather than after
+# a reconnect backoff.
+async def wait_until_ready(session, interval=0.05):
+    while True:
+        try:
+            return await get(session, "ready")
+        except Exception:
+            await asyncio.sleep(interval)
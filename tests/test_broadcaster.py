@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
+import app
+import bottle
+from broadcaster import Broadcaster
+
+class FakeState:
+    version = 1
+
+    def snapshot(self):
+        return {"answer": "TUTU", "version": self.version}
+
+def test_covers_rejects_ids_from_before_a_restart():
+    hub = Broadcaster()
+    hub.publish("push_state", {"answer": "TUTU"})
+    assert hub.covers(["push_state"], hub.last_id - 1)
+    assert not hub.covers(["push_state"], hub.first_id - 1)
+
+# A display reconnecting after app.py restarted sends the Last-Event-ID it got
+# from the old process; it must get a snapshot rather than nothing.
+def test_stale_last_event_id_gets_a_snapshot(monkeypatch):
+    monkeypatch.setattr(app, "hub", Broadcaster())
+    monkeypatch.setattr(app, "state", FakeState())
+    app.snapshot_cache.clear()
+    bottle.request.bind({"HTTP_LAST_EVENT_ID": str(app.hub.first_id - 1000)})
+    frames = app.stream_frames(["push_state"], False, 0.01)
+    try:
+        assert next(frames).startswith(b"retry:")
+        assert b'"answer": "TUTU"' in next(frames)
+    finally:
+        frames.close()
+
+def test_current_last_event_id_replays_without_a_snapshot(monkeypatch):
+    monkeypatch.setattr(app, "hub", Broadcaster())
+    monkeypatch.setattr(app, "state", FakeState())
+    app.snapshot_cache.clear()
+    last_id = app.hub.last_id
+    app.hub.publish("push_state", {"answer": "COFFEE"})
+    bottle.request.bind({"HTTP_LAST_EVENT_ID": str(last_id)})
+    frames = app.stream_frames(["push_state"], False, 0.01)
+    try:
+        assert next(frames).startswith(b"retry:")
+        assert b'"answer": "COFFEE"' in next(frames)
+    finally:
+        frames.close()
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
+import pygame
+
+from matrix_output import MatrixOutput
+
+class FakeCanvas:
+    def __init__(self):
+        self.image = None
+
+    def SetImage(self, image):
+        self.image = image.copy()
+
+class FakeMatrix:
+    def __init__(self):
+        self.shown = []
+
+    def CreateFrameCanvas(self):
+        return FakeCanvas()
+
+    def SwapOnVSync(self, canvas):
+        self.shown.append(canvas.image)
+        return FakeCanvas()
+
+def show(depth):
+    matrix = FakeMatrix()
+    output = MatrixOutput(matrix, (4, 2), -90)
+    output.start()
+    try:
+        screen = pygame.Surface((4, 2), depth=depth)
+        screen.fill((0, 0, 0))
+        screen.set_at((0, 0), (255, 0, 0))
+        output.publish(screen)
+        deadline = time.monotonic() + 2
+        while not matrix.shown and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        output.stop()
+    return matrix.shown
+
+# Without the numpy fast path (a 24-bit screen takes the PIL fallback) the
+# rotated frame must still reach the panel.
+def test_24_bit_screen_reaches_the_matrix():
+    [image] = show(24)
+    assert image.size == (2, 4)
+    # Rotated 90 degrees clockwise, the top left corner is now the top right.
+    assert image.getpixel((1, 0)) == (255, 0, 0)
+    assert image.getpixel((0, 0)) == (0, 0, 0)
+
+def test_32_bit_screen_reaches_the_matrix():
+    [image] = show(32)
+    assert image.getpixel((1, 0)) == (255, 0, 0)
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
+from serial_input import FakeSerial, SerialInput, open_serial
+
+class Events:
+    def __init__(self):
+        self.triggered = []
+
+    def trigger(self, event, *args):
+        self.triggered.append((event, *args))
+
+# Presses through a pty, as from the button board: each (delay, line) is
+# written "delay" seconds after the one before.
+async def press(presses):
+    fake = FakeSerial()
+    reader, device = await open_serial(fake.port)
+    events = Events()
+    serial_input = SerialInput(reader, events)
+    task = asyncio.create_task(serial_input.run())
+    try:
+        for delay, line in presses:
+            await asyncio.sleep(delay)
+            fake.press(line)
+        await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        device.close()
+        fake.close()
+    return events.triggered, serial_input
+
+def test_presses_become_requests():
+    triggered, serial_input = asyncio.run(press([(0, "start"), (0.3, "NEXT")]))
+    assert triggered == [("game.request", "start"), ("game.request", "next_answer")]
+    assert serial_input.stats()["accepted"] == 2
+
+def test_bounce_limit_and_unknown_are_dropped():
+    triggered, serial_input = asyncio.run(press([
+        (0, "start"),
+        (0.01, "start"),   # switch bounce
+        (0.1, "next"),     # too soon after the last press
+        (0, "bogus"),
+        (0.3, "next")]))
+    assert triggered == [("game.request", "start"), ("game.request", "next_answer")]
+    stats = serial_input.stats()
+    assert (stats["accepted"], stats["bounced"], stats["limited"], stats["unknown"]) == (
+        2, 1, 1, 1)
+
+def test_latency_ends_at_the_matrix_swap():
+    serial_input = SerialInput(None, Events())
+    serial_input.waiting = [1.0]
+    serial_input.frame_shown(3)
+    serial_input.swapped(2, 1.01)
+    assert serial_input.stats().get("latency_max_ms") is None
+    serial_input.swapped(3, 1.02)
+    assert round(serial_input.stats()["latency_max_ms"]) == 20
@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
+from cube_async import SseParser
+
+def feed_all(parser, *chunks):
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+def test_named_event_with_id():
+    parser = SseParser()
+    [event] = parser.feed(b"event: push_state\nid: 5\ndata: [1]\n\n")
+    assert (event.event, event.id, event.data) == ("push_state", "5", "[1]")
+    assert parser.last_event_id == "5"
+
+def test_crlf_split_across_reads():
+    parser = SseParser()
+    events = feed_all(parser, b"id: 1\r", b"\ndata: a\r\n\r", b"\n")
+    assert [(e.id, e.data) for e in events] == [("1", "a")]
+
+def test_multi_line_data():
+    [event] = SseParser().feed(b"data: one\ndata: two\ndata:three\n\n")
+    assert event.data == "one\ntwo\nthree"
+
+def test_comments_are_skipped():
+    events = SseParser().feed(b": keepalive\n\n: hi\ndata: x\n\n")
+    assert [e.data for e in events] == ["x"]
+
+def test_retry():
+    parser = SseParser()
+    assert parser.feed(b"retry: 500\n\n") == []
+    assert parser.retry == 500
+    parser.feed(b"retry: soon\n\n")
+    assert parser.retry == 500
+
+# The id only counts once its event is dispatched: a stream cut off before
+# the blank line must reconnect asking for that event again.
+def test_partial_frame_keeps_last_event_id():
+    parser = SseParser("4")
+    assert parser.feed(b"event: push_state\nid: 5\n") == []
+    assert parser.last_event_id == "4"
+    [event] = parser.feed(b"data: [1]\n\n")
+    assert event.id == "5"
+    assert parser.last_event_id == "5"
+
+def test_utf8_split_across_reads():
+    data = "data: é\n\n".encode()
+    [event] = feed_all(SseParser(), data[:7], data[7:])
+    assert event.data == "é"
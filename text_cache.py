@@ -0,0 +1,67 @@
+from collections import OrderedDict
+import pygame
+
+# LRU cache of rasterized text for pygame.freetype fonts. Entries are keyed by
+# (font file, size, color, text, width), so the same word or block of text
+# drawn again costs a blit instead of a rasterization.
+class TextCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, make):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        entry = self.entries[key] = make()
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _size(font, size):
+        return size or font.size
+
+    # (surface, rect) for text on a transparent background, as font.render.
+    def render(self, font, text, color, size=0):
+        size = self._size(font, size)
+        return self._get((font.path, size, color, text, None),
+            lambda: font.render(text, fgcolor=color, size=size))
+
+    def get_rect(self, font, text, size=0):
+        size = self._size(font, size)
+        return self._get((font.path, size, None, text, None),
+            lambda: font.get_rect(text, size=size))
+
+    # (surface, height) for text word-wrapped to width, on a transparent
+    # background. height is the baseline of the last line.
+    def layout(self, font, text, color, width, size=0):
+        size = self._size(font, size)
+        return self._get((font.path, size, color, text, width),
+            lambda: self._layout(font, text, color, width, size))
+
+    def _layout(self, font, text, color, width, size):
+        line_spacing = font.get_sized_height(size) + 2
+        x, y = 0, line_spacing
+        space = self.get_rect(font, ' ', size)
+        placed = []
+        for word in text.split(' '):
+            bounds = self.get_rect(font, word, size)
+            if x + bounds.width + bounds.x >= width:
+                x, y = 0, y + line_spacing
+            placed.append((word, (x, y - bounds.y)))
+            x += bounds.width + space.width
+
+        surface = pygame.Surface((width, y + line_spacing), pygame.SRCALPHA)
+        for word, pos in placed:
+            if word:
+                surface.blit(self.render(font, word, color, size)[0], pos)
+        return surface, y
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,22 @@
+import time
+
+# Named milestones, in ms since the timeline was created, for seeing where
+# startup time goes. Create it before the slow imports so they count.
+class Timeline:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.marks = {}
+        self.reported = False
+
+    # Records name the first time it happens; "at" is a time.perf_counter()
+    # value from elsewhere, e.g. another thread, instead of now.
+    def mark(self, name, at=None):
+        if name not in self.marks:
+            self.marks[name] = ((time.perf_counter() if at is None else at) - self.start) * 1000
+
+    # One line, milestones in the order they happened.
+    def report(self):
+        self.reported = True
+        marks = sorted(self.marks.items(), key=lambda mark: mark[1])
+        return f"{self.name} startup: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in marks)
@@ -0,0 +1,94 @@
+from collections import deque
+import os
+import time
+
+# Follows one input (a request to app.py) through to the frame that shows its
+# result. app.py starts a trace context when the request comes in and sends
+# it along in the push_state delta as "trace"; each stage it passes stamps a
+# span, a time.monotonic() value. Both processes run on one machine, so their
+# monotonic clocks agree.
+#
+#   received      app.py's route was called
+#   published     the game changed and the delta is about to be published
+#   sse_received  the display parsed the SSE frame
+#   applied       EventEngine delivered the delta to Game.apply_state
+#   drawn         a frame was drawn with it
+#   shown         that frame went to the displays (window updated, matrix
+#                 buffer handed over)
+#   swapped       the matrix showed the frame (SwapOnVSync returned)
+STAGES = ("received", "published", "sse_received", "applied", "drawn", "shown", "swapped")
+
+def new_trace(route):
+    return {"id": os.urandom(6).hex(), "route": route,
+        "spans": {"received": time.monotonic()}}
+
+def stamp(trace, stage, at=None):
+    trace["spans"].setdefault(stage, time.monotonic() if at is None else at)
+
+# Stamps the trace of every event argument that carries one.
+def stamp_args(args, stage):
+    for arg in args:
+        if type(arg) is dict and "trace" in arg:
+            stamp(arg["trace"], stage)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+# Time between consecutive stages ("hops") of finished traces, in ms, kept
+# for the last "history" traces, and their percentiles on demand.
+class Tracer:
+    def __init__(self, history=1024):
+        self.history = history
+        self.hops = {}
+        self.completed = 0
+        self.slowest = None
+        # (trace, matrix frame number) for traces waiting for the matrix.
+        self.waiting = []
+
+    def _add(self, hop, ms):
+        self.hops.setdefault(hop, deque(maxlen=self.history)).append(ms)
+
+    def finish(self, trace):
+        spans = trace["spans"]
+        stages = [stage for stage in STAGES if stage in spans]
+        for before, after in zip(stages, stages[1:]):
+            self._add(f"{before}->{after}", (spans[after] - spans[before]) * 1000)
+        total = (spans[stages[-1]] - spans[stages[0]]) * 1000
+        self._add("total", total)
+        self.completed += 1
+        if self.slowest is None or total > self.slowest[0]:
+            self.slowest = (total, trace)
+
+    # For traces whose frame was handed to the matrix as frame number
+    # "frame"; they finish in swapped().
+    def wait_for_swap(self, trace, frame):
+        self.waiting.append((trace, frame))
+
+    # The matrix showed frame number "frame" (or a later one) at "at".
+    def swapped(self, frame, at):
+        if not self.waiting or frame is None:
+            return
+        still_waiting = []
+        for trace, waiting_for in self.waiting:
+            if waiting_for <= frame:
+                stamp(trace, "swapped", at)
+                self.finish(trace)
+            else:
+                still_waiting.append((trace, waiting_for))
+        self.waiting = still_waiting
+
+    def stats(self):
+        hops = {}
+        for hop, values in self.hops.items():
+            values = sorted(values)
+            hops[hop] = {"count": len(values),
+                "p50_ms": round(percentile(values, 0.5), 2),
+                "p95_ms": round(percentile(values, 0.95), 2),
+                "p99_ms": round(percentile(values, 0.99), 2),
+                "max_ms": round(values[-1], 2)}
+        slowest = None
+        if self.slowest:
+            total, trace = self.slowest
+            slowest = {"id": trace["id"], "route": trace["route"], "total_ms": round(total, 2)}
+        return {"completed": self.completed, "waiting": len(self.waiting), "hops": hops,
+            "slowest": slowest}
@@ -0,0 +1,125 @@
+import array
+import logging
+import mmap
+import os
+import random
+import struct
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WORDS\x01\x00\x00"
+HEADER = struct.Struct("<8sI")
+
+# A word list packed into one buffer plus an offset array, built once from a
+# text file (one word per line) into a binary index next to it and memory-
+# mapped from there. Processes that open the same list share its pages, and
+# looking up word i is O(1) without holding a list of str objects.
+#
+# Index layout: MAGIC, word count n (uint32), n+1 uint32 offsets into the
+# data, then the upper-cased UTF-8 words back to back.
+class WordStore:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path}: not a word index")
+        offsets_end = HEADER.size + 4 * (self.count + 1)
+        self.offsets = memoryview(self.mm)[HEADER.size:offsets_end].cast("I")
+        self.data_start = offsets_end
+
+    @staticmethod
+    def index_path_for(path):
+        return os.path.splitext(path)[0] + ".idx"
+
+    # Opens the index for the word file at path, (re)building it first if it
+    # is missing or older than the word file.
+    @classmethod
+    def open(cls, path):
+        index_path = cls.index_path_for(path)
+        try:
+            stale = os.path.getmtime(index_path) < os.path.getmtime(path)
+        except OSError:
+            stale = True
+        if stale:
+            cls.build(path, index_path)
+        return cls(index_path)
+
+    @staticmethod
+    def build(path, index_path):
+        offsets = array.array("I", [0])
+        data = bytearray()
+        with open(path, "r") as f:
+            for line in f:
+                word = line.strip().upper()
+                if word:
+                    data += word.encode()
+                    offsets.append(len(data))
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(offsets) - 1))
+            f.write(offsets.tobytes())
+            f.write(data)
+        # Atomic, so a process opening the index never sees half of it.
+        os.replace(tmp_path, index_path)
+        logger.info(f"WordStore: indexed {len(offsets) - 1} words from {path}")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start = self.data_start + self.offsets[i]
+        end = self.data_start + self.offsets[i + 1]
+        return self.mm[start:end].decode()
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def close(self):
+        self.offsets.release()
+        self.mm.close()
+
+# Draws indexes 0..n-1 in random order without replacement, one at a time.
+# This is a Fisher-Yates shuffle done lazily: only the positions touched so
+# far are remembered, so reset() and draw() are O(1) however long the list.
+#
+# last_pick is the random position the last draw used; passing it back to
+# draw() on a cursor in the same state repeats that draw, which is how a
+# journal replays one.
+class WordCursor:
+    def __init__(self, n, rng=random):
+        self.n = n
+        self.rng = rng
+        self.reset()
+
+    def reset(self):
+        self.remaining = self.n
+        self.swaps = {}
+        self.last_pick = None
+
+    def draw(self, pick=None):
+        if self.remaining == 0:
+            return None
+        last = self.remaining - 1
+        j = self.rng.randrange(self.remaining) if pick is None else pick
+        value = self.swaps.get(j, j)
+        if j != last:
+            self.swaps[j] = self.swaps.get(last, last)
+        self.swaps.pop(last, None)
+        self.remaining = last
+        self.last_pick = j
+        return value
+
+    def to_dict(self):
+        return {"n": self.n, "remaining": self.remaining, "swaps": list(self.swaps.items())}
+
+    @classmethod
+    def from_dict(cls, d, rng=random):
+        cursor = cls(d["n"], rng)
+        cursor.remaining = d["remaining"]
+        cursor.swaps = dict(d["swaps"])
+        return cursor